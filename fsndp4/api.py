@@ -6,13 +6,22 @@ from functools import wraps
 import logging
 
 import endpoints
-from google.appengine.api import oauth
 from google.appengine.ext import ndb
 from protorpc import messages, message_types, remote
 
+import archive
+import auth
+import bulk_delete
 import game_logic
+import metrics
+import rate_limit
+import wire
 from game_logic import GameLogicError
-from models import User, Game, Bid
+from models import User, Game, Bid, GameSummary, DeleteJob
+
+
+# How many of each game's most recent log entries users.dashboard shows by default
+DASHBOARD_LOG_LINES = 10
 
 
 # Valid endpoints exceptions:
@@ -41,6 +50,11 @@ class BidMessage(messages.Message):
     count = messages.IntegerField(1, required=True)
     rank = messages.IntegerField(2, required=True)
 
+class LegalMovesMessage(messages.Message):
+    bids = messages.MessageField(BidMessage, 1, repeated=True)
+    can_call_bluff = messages.BooleanField(2, required=True)
+    can_call_spot_on = messages.BooleanField(3, required=True)
+
 class GameIdMessage(messages.Message):
     value = messages.IntegerField(1, required=True)
 
@@ -68,6 +82,30 @@ class LeaderboardMessage(messages.Message):
 class LeaderboardCollection(messages.Message):
     leaderboard_messages = messages.MessageField(LeaderboardMessage, 1, repeated=True)
 
+class DashboardGameMessage(messages.Message):
+    game = messages.MessageField(GameMessage, 1, required=True)
+    hand = messages.MessageField(DiceMessage, 2)
+    is_my_turn = messages.BooleanField(3, required=True)
+    recent_log_messages = messages.MessageField(LogMessage, 4, repeated=True)
+
+class DashboardMessage(messages.Message):
+    standing = messages.MessageField(LeaderboardMessage, 1, required=True)
+    game_messages = messages.MessageField(DashboardGameMessage, 2, repeated=True)
+
+class JobMessage(messages.Message):
+    job_id = messages.IntegerField(1, required=True)
+    target = messages.StringField(2, required=True)
+    phase = messages.StringField(3)
+    deleted_count = messages.IntegerField(4, required=True)
+    done = messages.BooleanField(5, required=True)
+
+class MetricMessage(messages.Message):
+    name = messages.StringField(1, required=True)
+    value = messages.IntegerField(2, required=True)
+
+class MetricCollection(messages.Message):
+    metric_messages = messages.MessageField(MetricMessage, 1, repeated=True)
+
 
 # Helper methods for message creation
 def create_leaderboard_message(standing):
@@ -123,6 +161,53 @@ def create_bid_message(count, rank):
     inst.rank = int(rank)
     return inst
 
+def create_legal_moves_message(bids, can_call):
+    inst = LegalMovesMessage()
+    inst.bids = [create_bid_message(count, rank) for count, rank in bids]
+    inst.can_call_bluff = can_call
+    inst.can_call_spot_on = can_call
+    return inst
+
+def game_to_dashboard_message(game_model, user_key, log_lines):
+    """ Expects the game's users (and the user's Hand, for large tables) to be loaded already """
+    inst = DashboardGameMessage()
+    inst.game = game_to_message(game_model)
+    inst.hand = create_dice_message(game_model.get_hand(user_key))
+    inst.is_my_turn = game_model.active_player_key == user_key
+    tail = game_model.log[-log_lines:] if log_lines > 0 else []
+    inst.recent_log_messages = [create_log_message(x) for x in tail]
+    return inst
+
+def win_percentage(games_played, games_won):
+    """ Players who haven't finished a game yet rank at 0% """
+    if not games_played:
+        return 0.0
+    return float(games_won) / games_played
+
+@ndb.tasklet
+def win_percentage_async(user_key):
+    """ Completed games may be live or archived, so count both, all at once """
+    played, archived_played, won, archived_won = yield (
+        Game.query(Game.active == False, Game.player_keys == user_key).count_async(),
+        GameSummary.query(GameSummary.player_keys == user_key).count_async(),
+        Game.query(Game.active == False, Game.winner_key == user_key).count_async(),
+        GameSummary.query(GameSummary.winner_key == user_key).count_async())
+    raise ndb.Return(win_percentage(played + archived_played, won + archived_won))
+
+def job_to_message(job_model):
+    inst = JobMessage()
+    inst.job_id = job_model.key.id()
+    inst.target = job_model.target
+    inst.phase = job_model.phase
+    inst.deleted_count = job_model.deleted_count
+    inst.done = job_model.done
+    return inst
+
+def create_metric_collection(counts):
+    inst = MetricCollection()
+    inst.metric_messages = [MetricMessage(name=k, value=v) for k, v in sorted(counts.items())]
+    return inst
+
 def create_game_id_message(gid):
     inst = GameIdMessage()
     inst.value = int(gid)
@@ -192,11 +277,30 @@ class DEC_KEYS(object):
 @endpoints.api(name='liars_dice',
         version='v1',
         description="Liar's Dice API",
-        allowed_client_ids=(endpoints.API_EXPLORER_CLIENT_ID,),
+        allowed_client_ids=auth.ALLOWED_CLIENT_IDS,
         )
 class LiarsDiceApi(remote.Service):
 
     # API mixin decorators.  First, the basic ones with no prerequisites:    
+    def rate_limited(endpoint_class):
+        """
+        Applies the caller's token bucket for the given endpoint class
+        (see rate_limit.LIMITS).  Goes above @login_required, and only
+        looks at the auth token, so over-limit requests are turned away
+        before anything is loaded from the datastore.  Unauthenticated
+        requests are left for @login_required to reject.
+        """
+        def rate_limited_factory(func):
+            @wraps(func)
+            def rate_limited_dec(*args, **kwargs):
+                current_user = endpoints.get_current_user()
+                if current_user and not rate_limit.allow(current_user.email(), endpoint_class):
+                    # Endpoints v1 turns any 4xx it doesn't recognize (like 429) into a 404
+                    raise endpoints.ForbiddenException('Rate limit exceeded, try again later')
+                return func(*args, **kwargs)
+            return rate_limited_dec
+        return rate_limited_factory
+
     def login_required(func):
         """
         Requires that the API user be logged in before calling a method.
@@ -217,10 +321,14 @@ class LiarsDiceApi(remote.Service):
         """
         Requires that a valid game_id is provided (typically as a path variable).
         Saves the instance as a game_model kwarg.
+        Completed games that have been archived are loaded from the archive
+        (read-only, but they're inactive anyway, so no moves can be made).
         """            
         @wraps(func)
         def game_required_dec(self, request, *args, **kwargs):
             game_model = Game.get_by_id(request.game_id)
+            if not game_model:
+                game_model = archive.load_game(request.game_id)
             if not game_model:
                 raise endpoints.NotFoundException()
             kwargs[DEC_KEYS.GAME] = game_model
@@ -308,6 +416,7 @@ class LiarsDiceApi(remote.Service):
             http_method="POST",
             path="enroll_user",
             name="users.enroll")
+    @rate_limited('read')
     @login_required
     def enroll_user(self, request, **kwargs):
         """
@@ -321,6 +430,7 @@ class LiarsDiceApi(remote.Service):
             http_method="GET",
             path="users",
             name="users.list")
+    @rate_limited('admin')
     @login_required
     @admin_only
     def list_users(self, request):
@@ -330,16 +440,16 @@ class LiarsDiceApi(remote.Service):
         return response
 
     @endpoints.method(message_types.VoidMessage,
-            message_types.VoidMessage,
+            JobMessage,
             http_method="DELETE",
             path="users",
             name="users.delete")
+    @rate_limited('admin')
     @login_required
     @admin_only
     def delete_users(self, request, **kwargs):
-        """ Wipe all locally stored user info from the database """
-        User.delete_all()
-        return message_types.VoidMessage()
+        """ Wipe all locally stored user info from the database (poll jobs.get for progress) """
+        return job_to_message(User.delete_all())
 
     GAME_LIST_RC = endpoints.ResourceContainer(
         message_types.VoidMessage,
@@ -349,6 +459,7 @@ class LiarsDiceApi(remote.Service):
             http_method="GET",
             path="games",
             name="games.list")
+    @rate_limited('read')
     @login_required
     def list_games(self, request, **kwargs):
         """ List all active and completed games """
@@ -372,6 +483,7 @@ class LiarsDiceApi(remote.Service):
         http_method="GET",
         path="games/{game_id}",
         name="games.lookup")
+    @rate_limited('read')
     @login_required
     @game_required
     def lookup_game(self, request, **kwargs):
@@ -383,6 +495,7 @@ class LiarsDiceApi(remote.Service):
         http_method="GET",
         path="games/{game_id}/logs",
         name="games.logs.lookup")
+    @rate_limited('read')
     @login_required
     @game_required
     def lookup_game_logs(self, request, **kwargs):
@@ -390,29 +503,65 @@ class LiarsDiceApi(remote.Service):
         return game_to_log_collection(kwargs[DEC_KEYS.GAME])    
 
     @endpoints.method(message_types.VoidMessage,
-            message_types.VoidMessage,
+            JobMessage,
             http_method="DELETE",
             path="games",
             name="games.delete_all")
+    @rate_limited('admin')
     @login_required
     @admin_only
     def delete_all_games(self, request, **kwargs):
-        """ Wipe all active and completed games from the database """
-        Game.delete_all()
-        return message_types.VoidMessage()
+        """ Wipe all active and completed games from the database (poll jobs.get for progress) """
+        return job_to_message(Game.delete_all())
+
+    JOB_LOOKUP_RC = endpoints.ResourceContainer(
+        message_types.VoidMessage,
+        job_id=messages.IntegerField(1, required=True))
+    @endpoints.method(JOB_LOOKUP_RC,
+            JobMessage,
+            http_method="GET",
+            path="jobs/{job_id}",
+            name="jobs.get")
+    @rate_limited('admin')
+    @login_required
+    @admin_only
+    def get_job(self, request, **kwargs):
+        """ Check on the progress of a bulk delete job """
+        job = DeleteJob.get_by_id(request.job_id)
+        if not job:
+            raise endpoints.NotFoundException()
+        return job_to_message(job)
+
+    @endpoints.method(JOB_LOOKUP_RC,
+            JobMessage,
+            http_method="POST",
+            path="jobs/{job_id}/resume",
+            name="jobs.resume")
+    @rate_limited('admin')
+    @login_required
+    @admin_only
+    def resume_job(self, request, **kwargs):
+        """ Restart a bulk delete job from its last checkpoint, e.g. after a permanent task failure """
+        job = DeleteJob.get_by_id(request.job_id)
+        if not job:
+            raise endpoints.NotFoundException()
+        if not job.done:
+            job = bulk_delete.resume(job.key.id()) or job
+        return job_to_message(job)
 
     @endpoints.method(GAME_LOOKUP_RC,
         message_types.VoidMessage,
         http_method="DELETE",
         path="games/{game_id}",
         name="games.delete")
+    @rate_limited('move')
     @login_required
     @game_required
     @active_player_only
     @active_game_only
     def delete_game(self, request, **kwargs):
         """ Active player deletes a game, but ONLY if it's still in progress """
-        kwargs[DEC_KEYS.GAME].key.delete()
+        kwargs[DEC_KEYS.GAME].delete()
         return message_types.VoidMessage()
 
     @endpoints.method(UserCollection,
@@ -420,6 +569,7 @@ class LiarsDiceApi(remote.Service):
             http_method="POST",
             path="games",
             name="games.create")
+    @rate_limited('admin')
     @login_required
     @admin_only
     def create_game(self, request, **kwargs):
@@ -433,6 +583,9 @@ class LiarsDiceApi(remote.Service):
             player_emails.append(i.email)
         if len(player_emails) < 2:
             raise endpoints.BadRequestException("You must submit at least two players")
+        if len(player_emails) > game_logic.MAX_TABLE_PLAYERS:
+            raise endpoints.BadRequestException(
+                "You can submit at most {} players".format(game_logic.MAX_TABLE_PLAYERS))
         game = Game.create(player_emails)
         return create_game_id_message(game.key.id())
 
@@ -441,6 +594,7 @@ class LiarsDiceApi(remote.Service):
         http_method="GET",
         path="games/{game_id}/hand",
         name="games.hand.get")
+    @rate_limited('read')
     @login_required
     @game_required
     @enrolled_player_only
@@ -448,12 +602,77 @@ class LiarsDiceApi(remote.Service):
         """ Check the current player's hand in the given game """
         game = kwargs[DEC_KEYS.GAME]
         user_key = kwargs[DEC_KEYS.USER].key
-        if user_key not in game.dice or not game.dice[user_key]:
+        dice = game.get_hand(user_key)
+        if not dice:
             raise endpoints.NotFoundException("No hand found for current user in that game")
-        hand = create_dice_message(game.dice[user_key])
+        hand = create_dice_message(dice)
         return hand
 
 
+    @endpoints.method(GAME_LOOKUP_RC,
+        LegalMovesMessage,
+        http_method="GET",
+        path="games/{game_id}/legal_moves",
+        name="games.legal_moves")
+    @rate_limited('read')
+    @login_required
+    @game_required
+    @active_game_only
+    def get_legal_moves(self, request, **kwargs):
+        """ List every move the active player could legally make right now """
+        bids, can_call = game_logic.legal_moves(kwargs[DEC_KEYS.GAME])
+        return create_legal_moves_message(bids, can_call)
+
+
+    @endpoints.method(message_types.VoidMessage,
+            MetricCollection,
+            http_method="GET",
+            path="metrics",
+            name="metrics.list")
+    @rate_limited('admin')
+    @login_required
+    @admin_only
+    def list_metrics(self, request, **kwargs):
+        """ Show the operational counters, such as rate limit rejections and memcache hits, misses and evictions for each kind """
+        return create_metric_collection(metrics.snapshot())
+
+
+    DASHBOARD_RC = endpoints.ResourceContainer(
+        message_types.VoidMessage,
+        log_lines=messages.IntegerField(1))
+    @endpoints.method(DASHBOARD_RC,
+            DashboardMessage,
+            http_method="GET",
+            path="users/dashboard",
+            name="users.dashboard")
+    @rate_limited('read')
+    @login_required
+    def get_dashboard(self, request, **kwargs):
+        """ Everything for the current user's home screen: their active games and hands, and their standing """
+        user = kwargs[DEC_KEYS.USER]
+        log_lines = DASHBOARD_LOG_LINES if request.log_lines is None else request.log_lines
+        games_future = Game.query(
+            Game.active == True, Game.player_keys == user.key).fetch_async()
+        standing_future = win_percentage_async(user.key)
+
+        # Batch-load everyone the games mention, and our own hands at large
+        # tables, while the standing counts are still running
+        games = games_future.get_result()
+        user_keys = set([user.key])
+        for game in games:
+            user_keys.update(wire.referenced_user_keys(game))
+        futures = ndb.get_multi_async(list(user_keys))
+        futures += [x.prefetch_hands_async([user.key]) for x in games]
+        ndb.Future.wait_all(futures + [standing_future])
+
+        # Games waiting on us go first
+        games.sort(key=lambda x: x.active_player_key != user.key)
+        response = DashboardMessage()
+        response.standing = create_leaderboard_message((user, standing_future.get_result()))
+        response.game_messages = [game_to_dashboard_message(x, user.key, log_lines) for x in games]
+        return response
+
+
     # Used below to help sort the standings tuples
     def get_key(self, item):
         return item[1]
@@ -463,23 +682,15 @@ class LiarsDiceApi(remote.Service):
             http_method="GET",
             path="users/standings",
             name="users.standings")
+    @rate_limited('read')
     @login_required
     def get_player_standings(self, request, **kwargs):
         """ Shows the player leaderboards, ranked by game win percentage """
-        standings = []
-        for user in User.get_all():
-            games_played = 0
-            games_won = 0            
-            result = Game.query(Game.active == False, Game.player_keys.IN([user.key])).fetch()
-            if result:
-                games_played = float(len(result))
-            
-            result = Game.query(Game.active == False, Game.winner_key == user.key).fetch()
-            if result:
-                games_won = float(len(result))
-
-            win_perc = games_won / games_played
-            standings.append((user, win_perc))
+        users = User.get_all()
+        # Every user's counts run concurrently, rather than four queries at a time
+        futures = [win_percentage_async(x.key) for x in users]
+        ndb.Future.wait_all(futures)
+        standings = [(user, future.get_result()) for user, future in zip(users, futures)]
         sorted_standings = sorted(standings, key=self.get_key)
         return create_leaderboard_collection(sorted_standings)
 
@@ -495,6 +706,7 @@ class LiarsDiceApi(remote.Service):
         http_method="POST",
         path="games/{game_id}/bids",
         name="games.bids.create")
+    @rate_limited('move')
     @login_required
     @game_required
     @active_player_only
@@ -513,6 +725,7 @@ class LiarsDiceApi(remote.Service):
         http_method="POST",
         path="games/{game_id}/bluff_calls",
         name="games.bluff_calls.create")
+    @rate_limited('move')
     @login_required
     @game_required
     @active_player_only
@@ -529,6 +742,7 @@ class LiarsDiceApi(remote.Service):
         http_method="POST",
         path="games/{game_id}/spot_on_calls",
         name="games.spot_on_calls.create")
+    @rate_limited('move')
     @login_required
     @game_required
     @active_player_only
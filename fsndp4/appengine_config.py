@@ -0,0 +1,15 @@
+"""
+Loaded by App Engine before any of our modules.  Makes third party
+libraries vendored into lib/ importable; so far that's only cloudstorage,
+which exports to gs:// destinations need (see README).
+"""
+import os
+
+from google.appengine.ext import vendor
+
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+
+# vendor.add() refuses a missing directory, and lib/ is optional
+if os.path.isdir(LIB_DIR):
+    vendor.add(LIB_DIR)
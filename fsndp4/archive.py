@@ -0,0 +1,170 @@
+"""
+Moves completed games out of the Game kind and into compressed
+GameArchive records, leaving a GameSummary behind for each one.
+
+Archived games can still be read with load_game(), which rebuilds an
+unsaved Game model from the archive.  Runs as a task queue job; other
+modules should call start() to kick one off.
+"""
+import datetime
+import json
+import logging
+import zlib
+
+from google.appengine.ext import ndb
+
+import cursor_jobs
+import wire
+from models import User, Game, Bid, GameArchive, GameSummary
+
+
+# Completed games archived per datastore round trip
+ARCHIVE_BATCH_SIZE = 100
+# Archives stay well below the 1MB entity limit so they still fit in memcache
+MAX_ARCHIVE_BYTES = 500 * 1000
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def start():
+    cursor_jobs.start(__archive_step, 0)
+
+def __archive_step(archived):
+    # Unlike the email task, retrying this job is harmless: see archive_games
+    count = archive_batch()
+    if not count:
+        logging.info("Archive task complete, archived {} games".format(archived))
+        return None
+    return archived + count
+
+
+def archive_batch():
+    """ Archives the next batch of completed games, returns how many were archived """
+    keys = Game.query(Game.active == False).fetch(ARCHIVE_BATCH_SIZE, keys_only=True)
+    # Queries are eventually consistent; re-check against the entities themselves
+    games = [x for x in ndb.get_multi(keys) if x and not x.active]
+    if not games:
+        return 0
+    archive_games(games)
+    return len(games)
+
+def archive_games(games):
+    """
+    Archive {games} and delete the live copies.  Safe to re-run after a
+    failure at any point without leaving orphaned archives behind:
+      - summaries go in before their archives, so a stored archive always
+        has summaries pointing at it
+      - a game whose summary and archive are both stored is only deleted,
+        never archived again
+      - an archive's ID comes from its first game, so two runs over the
+        same batch write the same record
+    """
+    done = archived_ids(games)
+    pending = [x for x in games if x.key.id() not in done]
+    if pending:
+        records = [serialize_game(x) for x in pending]
+        packed = pack_records(records)
+        archive_keys = [ndb.Key(GameArchive, archive_id(batch)) for _, batch in packed]
+
+        games_by_id = dict((x.key.id(), x) for x in pending)
+        summaries = []
+        for archive_key, (_, batch) in zip(archive_keys, packed):
+            for record in batch:
+                game = games_by_id[record['id']]
+                summaries.append(GameSummary(
+                    id=game.key.id(),
+                    player_keys=game.player_keys,
+                    winner_key=game.winner_key,
+                    archive_key=archive_key))
+        ndb.put_multi(summaries)
+        ndb.put_multi([GameArchive(key=k, data=blob, game_count=len(batch))
+                       for k, (blob, batch) in zip(archive_keys, packed)])
+    # Only remove the live games once everything needed to read them back is stored
+    keys = []
+    for game in games:
+        keys += game.owned_keys()
+    ndb.delete_multi(keys)
+    wire.invalidate_deleted(keys)
+
+def archived_ids(games):
+    """ IDs of the {games} an earlier run already stored a summary and archive for """
+    summaries = [x for x in ndb.get_multi([ndb.Key(GameSummary, x.key.id()) for x in games]) if x]
+    archive_keys = list(set(x.archive_key for x in summaries))
+    stored = set(k for k, x in zip(archive_keys, ndb.get_multi(archive_keys)) if x)
+    return set(x.key.id() for x in summaries if x.archive_key in stored)
+
+def archive_id(records):
+    """
+    Archives are named after their first game.  Names are strings, so they
+    can't collide with the numeric IDs of archives from before this scheme.
+    """
+    return 'game-{}'.format(records[0]['id'])
+
+def pack_records(records):
+    """
+    Compress {records} into as few blobs as possible while keeping
+    each one under MAX_ARCHIVE_BYTES.  Returns (blob, records) pairs.
+    """
+    blob = zlib.compress(json.dumps(records, separators=(',', ':')), 9)
+    if len(blob) <= MAX_ARCHIVE_BYTES or len(records) == 1:
+        return [(blob, records)]
+    mid = len(records) // 2
+    return pack_records(records[:mid]) + pack_records(records[mid:])
+
+
+def key_id(key):
+    return key.id() if key else None
+
+def user_key(user_id):
+    return ndb.Key(User, user_id) if user_id else None
+
+def serialize_game(game):
+    """ Flatten a Game into a JSON-friendly dict; per-player values follow player_keys order """
+    hb = game.high_bid
+    game.prefetch_hands(game.player_keys)
+    return {
+        'id': game.key.id(),
+        'players': [x.id() for x in game.player_keys],
+        'active_player': key_id(game.active_player_key),
+        'winner': key_id(game.winner_key),
+        'scores': [game.scores[x] for x in game.player_keys],
+        'dice': [game.get_hand(x) for x in game.player_keys],
+        'high_bidder': key_id(game.high_bidder_key),
+        'high_bid': [hb.count, hb.rank] if hb else None,
+        'log': game.log,
+        'active': game.active,
+        'updated': game.updated.strftime(TIMESTAMP_FORMAT),
+    }
+
+def deserialize_game(record):
+    """
+    Rebuild a Game from its archive record.  The result is read-only:
+    it must never be put(), or the game would be resurrected as a live entity.
+    """
+    game = Game(id=record['id'])
+    player_keys = [user_key(x) for x in record['players']]
+    game.player_keys = player_keys
+    game.active_player_key = user_key(record['active_player'])
+    game.winner_key = user_key(record['winner'])
+    game.scores = dict(zip(player_keys, record['scores']))
+    game.dice = dict(zip(player_keys, record['dice']))
+    game.high_bidder_key = user_key(record['high_bidder'])
+    hb = record['high_bid']
+    game.high_bid = Bid.create(hb[0], hb[1]) if hb else None
+    game.log = record['log']
+    game.active = record['active']
+    game.updated = datetime.datetime.strptime(record['updated'], TIMESTAMP_FORMAT)
+    return game
+
+
+def load_game(game_id):
+    """ Look up an archived game by its original ID, returns None if it isn't archived """
+    summary = GameSummary.get_by_id(game_id)
+    if not summary:
+        return None
+    archive = summary.archive_key.get()
+    if not archive:
+        return None
+    for record in archive.records():
+        if record['id'] == game_id:
+            return deserialize_game(record)
+    return None
@@ -0,0 +1,41 @@
+"""
+Which OAuth clients may call our API.  Shared by the Endpoints service
+(api.py) and the direct JSON handlers (main.py), so a token that one of
+them turns away is turned away by the other too.  Like Endpoints, the
+direct handlers accept both Google ID tokens and OAuth access tokens.
+"""
+import time
+
+
+# Same value as endpoints.API_EXPLORER_CLIENT_ID, spelled out so the
+# fast path doesn't have to import the endpoints library at startup
+API_EXPLORER_CLIENT_ID = '292824132082.apps.googleusercontent.com'
+ALLOWED_CLIENT_IDS = (API_EXPLORER_CLIENT_ID,)
+
+# Same scope Endpoints uses to identify the caller
+EMAIL_SCOPE = 'https://www.googleapis.com/auth/userinfo.email'
+# Endpoints accepts tokens in either of these Authorization header schemes
+AUTH_SCHEMES = ('OAuth ', 'Bearer ')
+
+
+def id_token_user(authorization):
+    """
+    The users.User for a Google ID token in an Authorization header, or
+    None if it doesn't hold a valid one.  Endpoints tries ID tokens before
+    OAuth access tokens, so the direct JSON handlers do too.
+    """
+    for scheme in AUTH_SCHEMES:
+        if authorization.startswith(scheme):
+            token = authorization[len(scheme):]
+            break
+    else:
+        return None
+    # ID tokens are JWTs (header.payload.signature), access tokens aren't,
+    # so only ID tokens pay for loading the endpoints library
+    if token.count('.') != 2:
+        return None
+    from google.appengine.api import memcache
+    from endpoints import users_id_token
+    # The same check Endpoints runs, down to the memcached Google certs
+    return users_id_token._get_id_token_user(
+        token, (), ALLOWED_CLIENT_IDS, int(time.time()), memcache)
@@ -0,0 +1,97 @@
+"""
+Streaming bulk deletion for the admin wipe endpoints.
+
+Walks each kind with a keys-only query cursor and deletes one page at a
+time, splitting every page into smaller delete_multi batches with at
+most MAX_IN_FLIGHT of them running at once.  Progress is checkpointed
+in a DeleteJob after every page, so a task that dies (or a job that's
+resumed by hand) picks up where the last one left off, and admins can
+poll the job to watch it run.  Resuming hands the job to a new chain of
+tasks, and the old one stops at its next step (see cursor_jobs.claim).
+
+Other modules should call start() with one of the names in TARGETS.
+"""
+import logging
+
+from google.appengine.ext import ndb
+
+import cursor_jobs
+import wire
+from models import User, Game, Hand, GameSummary, GameArchive, DeleteJob
+
+
+# Target: kinds it deletes, in order
+TARGETS = {
+    'users': ['User'],
+    # Hands, summaries and archives all belong to games, so they go too
+    'games': ['Game', 'Hand', 'GameSummary', 'GameArchive'],
+}
+MODELS = {
+    'User': User,
+    'Game': Game,
+    'Hand': Hand,
+    'GameSummary': GameSummary,
+    'GameArchive': GameArchive,
+}
+PAGE_SIZE = 1000
+BATCH_SIZE = 100
+MAX_IN_FLIGHT = 4
+
+
+def start(target):
+    """ Create a new delete job and kick it off, returns the DeleteJob """
+    if target not in TARGETS:
+        raise ValueError("Unknown bulk delete target: {}".format(target))
+    job = DeleteJob(target=target, phase=TARGETS[target][0], run_token=cursor_jobs.new_token())
+    job.put()
+    logging.info("Starting bulk delete {} of {}".format(job.key.id(), target))
+    cursor_jobs.start(__delete_step, (job.key.id(), job.run_token))
+    return job
+
+def resume(job_id):
+    """
+    Restart a delete job from its last checkpoint, e.g. after a permanent
+    task failure.  Returns the DeleteJob, or None if it doesn't exist.
+    """
+    job = cursor_jobs.claim(ndb.Key(DeleteJob, job_id))
+    if job:
+        cursor_jobs.start(__delete_step, (job_id, job.run_token))
+    return job
+
+def __delete_step(state):
+    job_id, token = state
+    job = DeleteJob.get_by_id(job_id)
+    if not job or job.done:
+        return None
+    cursor_jobs.check_token(job, token)
+    delete_page(job)
+    if job.done:
+        logging.info("Bulk delete {} of {} complete, deleted {} entities".format(
+            job_id, job.target, job.deleted_count))
+        return None
+    return state
+
+def delete_page(job):
+    """ Delete the next page of the current phase, then checkpoint """
+    model = MODELS[job.phase]
+    keys, next_cursor, more = cursor_jobs.fetch_page(job, model.query(), PAGE_SIZE, keys_only=True)
+    delete_keys(keys)
+    job.deleted_count += len(keys)
+    cursor_jobs.advance(job, TARGETS[job.target], next_cursor, more)
+
+def delete_keys(keys):
+    """ delete_multi in BATCH_SIZE batches, keeping at most MAX_IN_FLIGHT running """
+    in_flight = []
+    for i in range(0, len(keys), BATCH_SIZE):
+        if len(in_flight) >= MAX_IN_FLIGHT:
+            finish_batch(*in_flight.pop(0))
+        batch = keys[i:i + BATCH_SIZE]
+        in_flight.append((batch, ndb.delete_multi_async(batch)))
+    for batch, futures in in_flight:
+        finish_batch(batch, futures)
+
+def finish_batch(keys, futures):
+    """ Wait for one delete_multi_async batch, raising its first error """
+    for future in futures:
+        future.check_success()
+    wire.invalidate_deleted(keys)
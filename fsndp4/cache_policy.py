@@ -0,0 +1,161 @@
+"""
+How long ndb keeps each kind in memcache, and how well that's working.
+
+ndb caches every entity it reads in memcache, by default with no expiry
+for every kind alike.  That suits Users and finished games, which are
+read constantly and rarely (or never) change, but not active Games,
+which are rewritten on every move and would mostly hold memory for
+copies that are about to be invalidated.  TIMEOUTS sets the policy for
+each kind in one place; Games get ACTIVE_GAME_TIMEOUT or
+COMPLETED_GAME_TIMEOUT depending on whether they've finished.
+
+ndb's memcache policy only sees keys, so completed games are tracked
+by ID in an in-process set, filled in as games are loaded and saved
+(see Game._post_get_hook and Game._post_put_hook).  An instance that
+hasn't seen a game yet caches it with the short timeout, which is
+always safe.
+
+A memcache post-call hook counts, for each kind, the ndb lookups that
+hit and missed, and the misses on entries this instance cached itself
+that should still have been live, which are evictions (approximate:
+other instances' writes aren't seen).  The counts are reported through
+metrics as cache.{kind}.{hits,misses,evictions}.
+"""
+import collections
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map, memcache
+from google.appengine.ext import ndb
+
+import metrics
+
+
+DAY = 24 * 60 * 60
+
+# Kind: seconds its entities stay in memcache, or None to skip memcache.
+# Kinds not listed keep ndb's default (cached with no expiry).
+TIMEOUTS = {
+    'User': DAY,
+    'GameSummary': DAY,
+    'GameArchive': DAY,
+    'Hand': 60,
+}
+ACTIVE_GAME_TIMEOUT = 60
+COMPLETED_GAME_TIMEOUT = DAY
+
+# Bounds on the in-process bookkeeping; both are only hints, so
+# forgetting entries just costs some accuracy
+MAX_COMPLETED_GAME_IDS = 100000
+MAX_TRACKED_ENTRIES = 10000
+
+# ndb's memcache keys are this prefix plus the entity key's urlsafe form
+NDB_KEY_PREFIX = 'NDB9:'
+
+STATS = ('hits', 'misses', 'evictions')
+METRIC = 'cache.{}.{}'
+
+_completed_game_ids = set()
+# memcache key -> (kind, expiry time) for entries this instance cached
+_cached_here = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def note_game(game):
+    """ Remember finished games, so they get the long timeout """
+    if game is None or game.active or not game.key:
+        return
+    if len(_completed_game_ids) >= MAX_COMPLETED_GAME_IDS:
+        _completed_game_ids.clear()
+    _completed_game_ids.add(game.key.id())
+
+def game_memcache_timeout(key):
+    if key.id() in _completed_game_ids:
+        return COMPLETED_GAME_TIMEOUT
+    return ACTIVE_GAME_TIMEOUT
+
+
+def kind_of(memcache_key):
+    """ The entity kind behind an ndb memcache key, or None for our own cache entries """
+    if not memcache_key.startswith(NDB_KEY_PREFIX):
+        return None
+    try:
+        return ndb.Key(urlsafe=memcache_key[len(NDB_KEY_PREFIX):]).kind()
+    except Exception:
+        return None
+
+def is_lock(item):
+    """ ndb writes a 0 into an entity's slot while it's being put """
+    return item.flags() == memcache.TYPE_INT and item.value() == '0'
+
+def expiry_of(item, now):
+    """ Like memcache itself, treat expiration times under 30 days as relative """
+    expires = item.expiration_time()
+    if not expires:
+        return now + 365 * DAY
+    if expires < 30 * DAY:
+        return now + expires
+    return expires
+
+def count_call(service, call, request, response):
+    """ memcache post-call hook, see the module docstring """
+    if call not in ('Get', 'Set', 'Delete'):
+        return
+    with _lock:
+        counts = track_call(call, request, response, time.time())
+    for name, count in counts.items():
+        metrics.incr(name, count)
+
+def track_call(call, request, response, now):
+    """ Returns {metric name: count} for one memcache call """
+    counts = {}
+    if call == 'Get':
+        found = dict((x.key(), x) for x in response.item_list())
+        for key in request.key_list():
+            kind = kind_of(key)
+            if kind is None:
+                continue
+            item = found.get(key)
+            if item is not None and not is_lock(item):
+                stat = 'hits'
+            else:
+                stat = 'misses'
+                tracked = _cached_here.pop(key, None)
+                if item is None and tracked and tracked[1] > now:
+                    name = METRIC.format(kind, 'evictions')
+                    counts[name] = counts.get(name, 0) + 1
+            name = METRIC.format(kind, stat)
+            counts[name] = counts.get(name, 0) + 1
+    elif call == 'Set':
+        for item in request.item_list():
+            key = item.key()
+            kind = kind_of(key)
+            if kind is None:
+                continue
+            _cached_here.pop(key, None)
+            if is_lock(item):
+                continue
+            _cached_here[key] = (kind, expiry_of(item, now))
+            if len(_cached_here) > MAX_TRACKED_ENTRIES:
+                _cached_here.popitem(last=False)
+    elif call == 'Delete':
+        for item in request.item_list():
+            _cached_here.pop(item.key(), None)
+    return counts
+
+
+def apply():
+    """ Install the per-kind policies on our models, and the hit rate counters """
+    for kind, timeout in TIMEOUTS.items():
+        model = ndb.Model._kind_map[kind]
+        if timeout is None:
+            model._use_memcache = False
+        else:
+            model._memcache_timeout = timeout
+    ndb.Model._kind_map['Game']._memcache_timeout = staticmethod(game_memcache_timeout)
+
+    metrics.register(*[METRIC.format(kind, stat)
+                       for kind in list(TIMEOUTS) + ['Game'] for stat in STATS])
+    hooks = apiproxy_stub_map.apiproxy.GetPostCallHooks()
+    # Append() ignores a second hook with the same name
+    hooks.Append('cache_policy', count_call, 'memcache')
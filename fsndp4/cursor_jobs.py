@@ -0,0 +1,126 @@
+"""
+Shared runner for our long task queue jobs (archiving, migrations,
+exports and bulk deletes).
+
+A job is a step function that does one bounded unit of work, usually a
+page of a cursor query.  It takes the job's state and returns the state
+for the next step, or None once there's nothing left to do.  run()
+calls it repeatedly for TASK_TIME_BUDGET seconds, then hands the state
+off to a fresh task, so no single request runs into the task deadline.
+Steps and states are pickled into the task, so steps must be module
+level functions and states small (an ID, a cursor, a count).
+
+Jobs that walk several kinds in turn checkpoint a phase and cursor in an
+entity (see ExportJob and DeleteJob); fetch_page() and advance() cover
+that part.  Those jobs can be resumed by hand while their old chain of
+tasks is still queued or running, so the entity also holds a run token
+naming the one chain allowed to move it.  claim() hands out a new token
+in a transaction, the chain carries its token in its state, and a step
+raises Superseded (check_token(), or advance() at its checkpoint) once
+the job has been claimed by another chain; run() then just stops.
+
+A step raises ConfigurationError when retrying can't help (a missing
+library, a destination we can't write to).  The job then stops for good:
+its on_failure function, if it has one, is called with the state and the
+error so it can record the failure, and the task isn't retried.
+
+Other modules should call start() with their step and initial state.
+"""
+import logging
+import time
+import uuid
+
+from google.appengine.ext import deferred, ndb
+
+
+# Seconds of work per task before handing off to a fresh one
+TASK_TIME_BUDGET = 5 * 60
+
+
+class ConfigurationError(Exception):
+    """ A job can't run as configured, so retrying its task is pointless """
+
+class Superseded(Exception):
+    """ The job was resumed by another chain of tasks, which now owns it """
+
+
+def name_of(step):
+    return "{}.{}".format(step.__module__, step.__name__)
+
+def start(step, state, on_failure=None):
+    logging.info("Firing {} task".format(name_of(step)))
+    deferred.defer(run, step, state, on_failure)
+
+def run(step, state, on_failure=None):
+    deadline = time.time() + TASK_TIME_BUDGET
+    # At least one step per task, so every task makes progress
+    while True:
+        try:
+            state = step(state)
+        except ConfigurationError as e:
+            logging.error("{} failed: {}".format(name_of(step), e))
+            if on_failure:
+                on_failure(state, e)
+            raise deferred.PermanentTaskFailure(str(e))
+        except Superseded as e:
+            logging.info("{} stopped: {}".format(name_of(step), e))
+            return
+        if state is None:
+            return
+        if time.time() >= deadline:
+            break
+    logging.info("{} ran out of time, continuing in a new task".format(name_of(step)))
+    deferred.defer(run, step, state, on_failure)
+
+
+def new_token():
+    return uuid.uuid4().hex
+
+@ndb.transactional
+def claim(key, **values):
+    """
+    Give the job at {key} a new run token, so any chain of tasks still
+    running it stops at its next step, and set {values} on it.  Returns
+    the updated job, or None if it doesn't exist.
+    """
+    job = key.get()
+    if not job:
+        return None
+    job.populate(run_token=new_token(), **values)
+    job.put()
+    return job
+
+def check_token(job, token):
+    """ Raise Superseded unless {job} still belongs to the chain holding {token} """
+    if not job or job.run_token != token:
+        raise Superseded("the job was resumed by another task, or deleted")
+
+@ndb.transactional
+def checkpoint(job):
+    """ Save {job}, unless another chain has claimed it since it was read """
+    check_token(job.key.get(), job.run_token)
+    job.put()
+
+def fetch_page(job, query, page_size, **options):
+    """ The page of {query} after {job}'s checkpoint, as (results, cursor, more) """
+    cursor = ndb.Cursor(urlsafe=job.cursor) if job.cursor else None
+    return query.fetch_page(page_size, start_cursor=cursor, **options)
+
+def advance(job, phases, next_cursor, more):
+    """
+    Move {job} past the page fetch_page() just returned: on to its next
+    cursor, or else to the next of {phases} (names in order), and mark
+    it done after the last one.  Then checkpoint it, raising Superseded
+    if it's been claimed by another chain.
+    """
+    if more and next_cursor:
+        job.cursor = next_cursor.urlsafe()
+    else:
+        job.cursor = None
+        i = phases.index(job.phase)
+        if i + 1 < len(phases):
+            job.phase = phases[i + 1]
+        else:
+            job.phase = None
+            job.done = True
+    checkpoint(job)
@@ -0,0 +1,194 @@
+"""
+Streaming export of our game corpus for offline analytics.
+
+Walks the User, Game and GameArchive kinds with query cursors and writes
+gzipped JSONL shards, one shard per page, so memory use stays bounded
+by the page size no matter how large the corpus grows.  Progress is
+checkpointed in an ExportJob after every shard; a task that dies (or a
+job that's resumed by hand) picks up from the last complete shard.
+Resuming hands the job to a new chain of tasks, and the old one stops at
+its next step (see cursor_jobs.claim).
+
+Destinations:
+  gs://bucket/prefix   Google Cloud Storage (needs the cloudstorage
+                       client library vendored into lib/, see README)
+  /some/directory      local filesystem, for dev_appserver only
+A destination we can't write to fails the job for good (see
+cursor_jobs.ConfigurationError) rather than retrying forever; StartExport
+checks it up front with destination_error().
+
+The export isn't a snapshot.  A game archived while the export runs can
+be written twice, once from the Game phase and again from GameArchive.
+Run exports clear of the nightly archive cron (see cron.yaml), or keep
+one record per game ID when reading the shards.
+
+Shards are named {destination}/{job_id}/{kind}-{shard:05d}.jsonl.gz.
+Every game record (live or archived) looks like:
+  {"id": 123, "players": [emails in seat order], "active_player": email,
+   "winner": email or null,
+   "active": bool, "scores": [...], "dice_counts": [...],
+   "updated": "...", "events": [see game_events.py]}
+"""
+import gzip
+import io
+import json
+import logging
+import os
+
+from google.appengine.ext import ndb
+
+import archive
+import cursor_jobs
+import game_events
+from models import User, Game, GameArchive, ExportJob
+
+
+# Kinds in export order, with how many entities go into each shard.
+# Archives each hold many games, so they're exported one at a time.
+PHASES = [
+    ('User', User, 1000),
+    ('Game', Game, 200),
+    ('GameArchive', GameArchive, 1),
+]
+PHASE_NAMES = [x[0] for x in PHASES]
+
+
+class LocalWriter(object):
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, name, data):
+        with open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(data)
+
+class GcsWriter(object):
+    def __init__(self, path):
+        # Optional dependency, only needed when exporting to Cloud Storage
+        import cloudstorage
+        self.gcs = cloudstorage
+        self.path = path
+
+    def write(self, name, data):
+        with self.gcs.open('{}/{}'.format(self.path, name), 'w',
+                           content_type='application/gzip') as f:
+            f.write(data)
+
+def is_dev_server():
+    return os.environ.get('SERVER_SOFTWARE', '').startswith('Development')
+
+def destination_error(destination):
+    """ Why we can't export to {destination}, or None if we can """
+    if destination.startswith('gs://'):
+        if not destination[len('gs://'):].strip('/'):
+            return "A gs:// destination needs a bucket name"
+        try:
+            import cloudstorage
+        except ImportError:
+            return "gs:// destinations need the cloudstorage library vendored into lib/ (see README)"
+    elif not is_dev_server():
+        return "Local directory destinations only work on the dev server"
+    return None
+
+def writer_for(destination, job_id):
+    error = destination_error(destination)
+    if error:
+        raise cursor_jobs.ConfigurationError(error)
+    if destination.startswith('gs://'):
+        return GcsWriter('/{}/{}'.format(destination[len('gs://'):].rstrip('/'), job_id))
+    return LocalWriter(os.path.join(destination, str(job_id)))
+
+
+def start(destination):
+    """ Create a new export job and kick it off, returns the ExportJob """
+    job = ExportJob(destination=destination, phase=PHASES[0][0], run_token=cursor_jobs.new_token())
+    job.put()
+    logging.info("Starting export {}".format(job.key.id()))
+    cursor_jobs.start(__export_step, (job.key.id(), job.run_token), __export_failed)
+    return job
+
+def resume(job_id):
+    """
+    Restart an export from its last checkpoint, e.g. after a permanent
+    task failure.  Returns the ExportJob, or None if it doesn't exist.
+    """
+    job = cursor_jobs.claim(ndb.Key(ExportJob, job_id), error=None)
+    if job:
+        cursor_jobs.start(__export_step, (job_id, job.run_token), __export_failed)
+    return job
+
+@ndb.transactional
+def __export_failed(state, error):
+    job_id, token = state
+    job = ExportJob.get_by_id(job_id)
+    # If it's been resumed since, the error is already out of date
+    if job and job.run_token == token:
+        job.error = str(error)
+        job.put()
+
+def __export_step(state):
+    job_id, token = state
+    job = ExportJob.get_by_id(job_id)
+    if not job or job.done:
+        return None
+    cursor_jobs.check_token(job, token)
+    export_shard(job, writer_for(job.destination, job_id))
+    if job.done:
+        logging.info("Export {} complete: {} records in {} shards".format(
+            job_id, job.record_count, job.shard_count))
+        return None
+    return state
+
+def export_shard(job, writer):
+    """ Write the next page of the current phase as one shard, then checkpoint """
+    name, model, page_size = PHASES[PHASE_NAMES.index(job.phase)]
+    entities, next_cursor, more = cursor_jobs.fetch_page(job, model.query(), page_size)
+
+    records = []
+    for entity in entities:
+        records.extend(RECORD_BUILDERS[name](entity))
+    if records:
+        shard_name = '{}-{:05d}.jsonl.gz'.format(name.lower(), job.shard_count)
+        writer.write(shard_name, encode_shard(records))
+        job.shard_count += 1
+        job.record_count += len(records)
+    cursor_jobs.advance(job, PHASE_NAMES, next_cursor, more)
+
+def encode_shard(records):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        for record in records:
+            f.write(json.dumps(record, separators=(',', ':')))
+            f.write('\n')
+    return buf.getvalue()
+
+
+def user_records(user):
+    yield {'email': user.email, 'is_admin': user.is_admin}
+
+def game_record(game):
+    return {
+        'id': game.key.id(),
+        'players': [x.id() for x in game.player_keys],
+        'active_player': game.active_player_key.id(),
+        'winner': game.winner_key.id() if game.winner_key else None,
+        'active': game.active,
+        'scores': [game.scores[x] for x in game.player_keys],
+        'dice_counts': [game.hand_size(x) for x in game.player_keys],
+        'updated': game.updated.strftime(archive.TIMESTAMP_FORMAT),
+        'events': game_events.parse_log(game.log),
+    }
+
+def game_records(game):
+    yield game_record(game)
+
+def archive_records(game_archive):
+    for record in game_archive.records():
+        yield game_record(archive.deserialize_game(record))
+
+RECORD_BUILDERS = {
+    'User': user_records,
+    'Game': game_records,
+    'GameArchive': archive_records,
+}
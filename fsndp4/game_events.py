@@ -0,0 +1,78 @@
+"""
+Parses the human-readable game log (see Game.log_entry and game_logic)
+back into structured events, for exports and offline analysis.
+
+Each event is a dict with a 'type' key, plus:
+  start                                   (new game)
+  bid       player, count, rank
+  call      player, call ('bluff' or 'spot_on')
+  reveal    player, hand                  (high bidder's hand at a call)
+  lose_die  player, correct               (a single player loses a die)
+  lose_die_others                         (correct spot on: everyone else does)
+  reroll                                  (turn complete)
+  round_won player, score
+  refill                                  (new round)
+  game_won  player
+  turn      player                        (new active player)
+  unknown   text
+Events that followed an "At time ...:" entry also carry it as 'at'.
+"""
+import re
+
+
+TIMESTAMP_RE = re.compile(r"^At time (.+):$")
+PATTERNS = [
+    ('start', re.compile(r"^Started a new game\.$"), ()),
+    ('bid', re.compile(r"^(.+) placed the bid (\d+)x(\d+)$"), ('player', 'count', 'rank')),
+    ('call_bluff', re.compile(r"^(.+) called a bluff$"), ('player',)),
+    ('call_spot_on', re.compile(r"^(.+) called spot on$"), ('player',)),
+    ('reveal', re.compile(r"^(.+)'s actual hand was \[(.*)\]$"), ('player', 'hand')),
+    ('lose_die_others', re.compile(r"^Correct!  Everyone else loses a die$"), ()),
+    ('lose_die', re.compile(r"^(Correct|Incorrect)!  (.+) loses a die$"), ('correct', 'player')),
+    ('reroll', re.compile(r"^Turn complete, rerolling hands$"), ()),
+    ('round_won', re.compile(r"^Round complete, (.+) gains a point \(\d+ -> (\d+)\)$"), ('player', 'score')),
+    ('refill', re.compile(r"^Reloading player hands$"), ()),
+    ('game_won', re.compile(r"^Game over, (.+) wins!$"), ('player',)),
+    ('turn', re.compile(r"^It is now (.+)'s turn$"), ('player',)),
+]
+INT_FIELDS = ('count', 'rank', 'score')
+
+
+def parse_entry(text):
+    """ Parse one log line into an event dict """
+    for event_type, pattern, fields in PATTERNS:
+        match = pattern.match(text)
+        if not match:
+            continue
+        event = dict(zip(fields, match.groups()))
+        if event_type in ('call_bluff', 'call_spot_on'):
+            event['call'] = event_type[len('call_'):]
+            event_type = 'call'
+        for name in INT_FIELDS:
+            if name in event:
+                event[name] = int(event[name])
+        if 'hand' in event:
+            # Python 2 may print long ints with an L suffix
+            faces = [x.strip().rstrip('L') for x in event['hand'].split(',')]
+            event['hand'] = [int(x) for x in faces if x]
+        if 'correct' in event:
+            event['correct'] = event['correct'] == 'Correct'
+        event['type'] = event_type
+        return event
+    return {'type': 'unknown', 'text': text}
+
+def parse_log(lines):
+    """ Parse a full game log, attaching timestamps to the event that follows them """
+    events = []
+    timestamp = None
+    for line in lines:
+        match = TIMESTAMP_RE.match(line)
+        if match:
+            timestamp = match.group(1)
+            continue
+        event = parse_entry(line)
+        if timestamp:
+            event['at'] = timestamp
+            timestamp = None
+        events.append(event)
+    return events
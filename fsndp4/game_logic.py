@@ -51,6 +51,13 @@ def roll_hand(hand_size=STARTING_HAND_SIZE):
     """ Rolls a new starting hand """
     return [roll() for x in range(hand_size)]
 
+# Tables at least this big store each hand separately (see models.Hand)
+LARGE_TABLE_PLAYERS = 50
+# A new round rewrites every Hand in the same transaction as the game
+# (see Game.put), and the datastore commits at most this many entities
+MAX_COMMIT_ENTITIES = 500
+MAX_TABLE_PLAYERS = MAX_COMMIT_ENTITIES - 1
+
 def reset_scores(game):
     """ Initializes the game's scores array so it can be incremented later. """
     game.scores = {x: 0 for x in game.player_keys}
@@ -58,15 +65,47 @@ def reset_scores(game):
 def refill_hands(game):
     """ Rolls a new starting hand for all players in the game (new round). """
     game.reset_high_bid()
-    game.dice = {x: roll_hand() for x in game.player_keys}
+    game.dice = {}
+    for x in game.player_keys:
+        game.set_hand(x, roll_hand())
+    reset_turn_order(game)
 
 def reroll_hands(game):
     """ Rerolls all player hands, -without- replacing missing die (new turn) """
     game.reset_high_bid()
-    game.dice = {x: roll_hand(hand_size=len(game.dice[x])) for x in game.player_keys}
+    # Eliminated players have nothing to reroll
+    for x in get_living_player_keys(game):
+        game.set_hand(x, roll_hand(hand_size=game.hand_size(x)))
 
 BID_COUNTS = range(1, STARTING_HAND_SIZE + 1)
 BID_RANKS = range(1, 7)
+
+# Every possible (count, rank) bid, weakest first.  Our bidding rules are
+# a lexicographic ordering, so a bid beats another exactly when it comes
+# later in this list, and the legal raises over any high bid are a suffix.
+BID_LATTICE = [(c, r) for c in BID_COUNTS for r in BID_RANKS]
+BID_INDEX = dict((bid, i) for i, bid in enumerate(BID_LATTICE))
+
+def first_legal_bid_index(high_bid):
+    """ Position in BID_LATTICE of the weakest bid that beats {high_bid} """
+    if not high_bid:
+        return 0
+    return BID_INDEX[(high_bid.count, high_bid.rank)] + 1
+
+def legal_bids(high_bid):
+    """ All (count, rank) bids that may follow {high_bid}, weakest first """
+    return BID_LATTICE[first_legal_bid_index(high_bid):]
+
+def legal_moves(game):
+    """
+    Returns (bids, can_call) for the active player: every legal new bid,
+    and whether there's a standing bid to call as a bluff or spot on.
+    """
+    if not game.active:
+        return [], False
+    can_call = bool(game.high_bid and game.high_bidder_key)
+    return legal_bids(game.high_bid), can_call
+
 def place_bid(game, new_bid):
     """
     The active player's (possibly fraudulent) assertion that they have at least
@@ -83,21 +122,15 @@ def place_bid(game, new_bid):
     if new_bid.rank not in BID_RANKS:
         raise InvalidMoveError("Invalid bid rank")
 
-    old_bid = game.high_bid
-
-    if not old_bid:
-        __do_place_bid(game, new_bid)
-    elif new_bid.count > old_bid.count:
-        __do_place_bid(game, new_bid)
-    elif new_bid.count == old_bid.count and new_bid.rank > old_bid.rank:
-        __do_place_bid(game, new_bid)
-    else:
+    if BID_INDEX[(new_bid.count, new_bid.rank)] < first_legal_bid_index(game.high_bid):
         raise InvalidMoveError("Illegal bid")
+    __do_place_bid(game, new_bid)
 
 def __do_place_bid(game, new_bid):
     """
     Error checks passed, now actually commit the bid.
     """
+    ensure_turn_order(game)
     game.log_entry("{} placed the bid {}x{}".format(
         game.active_player_email(), new_bid.count, new_bid.rank),
         timestamp=True)
@@ -114,13 +147,14 @@ def call_bluff(game):
     if not (game.high_bid and game.high_bidder_key):
         raise InvalidMoveError("There are no standing bids")
 
+    ensure_turn_order(game)
     game.log_entry("{} called a bluff".format(
         game.active_player_email()),
         timestamp=True)
     actual_count = get_count(game, game.high_bidder_key, game.high_bid.rank)
     game.log_entry("{}'s actual hand was {}".format(
         game.high_bidder_email(),
-        game.dice[game.high_bidder_key]))
+        game.get_hand(game.high_bidder_key)))
     if actual_count < game.high_bid.count:
         game.log_entry("Correct!  {} loses a die".format(
             game.high_bidder_email()))
@@ -142,16 +176,18 @@ def call_spot_on(game):
     if not (game.high_bid and game.high_bidder_key):
         raise InvalidMoveError("There are no standing bids")
 
+    ensure_turn_order(game)
     game.log_entry("{} called spot on".format(
         game.active_player_email()),
         timestamp=True)
     actual_count = get_count(game, game.high_bidder_key, game.high_bid.rank)
     game.log_entry("{}'s actual hand was {}".format(
         game.high_bidder_email(),
-        game.dice[game.high_bidder_key]))
+        game.get_hand(game.high_bidder_key)))
     if actual_count == game.high_bid.count:
         game.log_entry("Correct!  Everyone else loses a die")
-        for pk in game.player_keys:
+        # Players who are already out have no dice left to lose
+        for pk in get_living_player_keys(game):
             if pk != game.active_player_key:
                 remove_die(game, pk)
     else:
@@ -164,15 +200,23 @@ def call_spot_on(game):
 
 
 def turn_complete(game):
-    living_player_keys = get_living_player_keys(game)
-    if len(living_player_keys) == 1:
-        round_complete(game, living_player_keys[0])
+    if game.living_count == 1:
+        winner_seat = next_living_seat(game, game.seat_of(game.active_player_key))
+        round_complete(game, game.player_keys[winner_seat])
     else:
         game.log_entry("Turn complete, rerolling hands")
         reroll_hands(game)
 
 def get_living_player_keys(game):
-    return [x for x in game.dice if game.dice[x]]
+    """ Players who still have dice, in seating order """
+    if game.living_count < 1:
+        return []
+    seat = next_living_seat(game, len(game.player_keys) - 1)
+    keys = []
+    for _ in range(game.living_count):
+        keys.append(game.player_keys[seat])
+        seat = game.seat_next[seat]
+    return keys
 
 POINTS_TO_WIN = 2
 def round_complete(game, winner_key):
@@ -199,12 +243,14 @@ def get_count(game, player_key, rank):
     Count the number of dice in {player}'s hand in {game} whose faces
     are exactly equal to {rank}.
     """    
-    hand = game.dice[player_key]
+    hand = game.get_hand(player_key)
     return len([x for x in hand if x==rank])
 
 def remove_die(game, player_key):
     """ Physically removes a die from a player's pool, so that subsequent rolls will be weaker. """
-    del game.dice[player_key][0]
+    game.drop_die(player_key)
+    if not game.hand_size(player_key):
+        eliminate_seat(game, game.seat_of(player_key))
 
 def assign_next_player(game):
     """
@@ -219,35 +265,77 @@ def assign_next_player(game):
 
 def __choose_next_player(game):
     """ 
-    Traverse the full player list, starting with the active player.
-    Return the first key we find that's still a living_player.
+    Starting after the active player, return the first key we find
+    that's still a living player (possibly the active player themselves,
+    if they're the only one left).
     """
-    living_player_keys = get_living_player_keys(game)
-    lp_count = len(living_player_keys)
-    if lp_count < 1:
+    if game.living_count < 1:
         raise GameRosterError("Tried to pick a new active player, but no one is still alive")
-    if lp_count == 1:
-        return living_player_keys[0]
-
-    # There's more than one player still in the game, so we need to do a full traversal
-    all_player_keys = __reslice_array(game.active_player_key, game.player_keys)
-    for i in all_player_keys:
-        if (i != game.active_player_key) and (i in living_player_keys):
-            return i
-
-    # A match should have been found if all our preconditions were met, throw an error
-    raise GameRosterError("Unable to choose next player")
-
-
-def __reslice_array(target_key, all_keys):
+    seat = next_living_seat(game, game.seat_of(game.active_player_key))
+    return game.player_keys[seat]
+
+
+# Turn order is kept as a doubly linked ring of seats (indexes into
+# player_keys): game.seat_next[i] and game.seat_prev[i] are the living
+# seats on either side of seat i.  Eliminating a player unlinks their
+# seat in O(1), but leaves its own pointers alone, so the turn can still
+# move on from a player who was just knocked out.
+def reset_turn_order(game):
+    """ Everyone has dice again, so every seat is part of the ring. """
+    rebuild_turn_order(game, range(len(game.player_keys)))
+
+def ensure_turn_order(game):
+    """ Games created before the ring existed get one built from their hands. """
+    if len(game.seat_next) != len(game.player_keys):
+        rebuild_turn_order(game, [i for i, x in enumerate(game.player_keys)
+                                  if game.hand_size(x)])
+
+def rebuild_turn_order(game, living_seats):
+    """
+    Link {living_seats} (in ascending order) into a ring.  Every other
+    seat points at its nearest living neighbours.
     """
-    Build a new list consising of two concatenated slices:
-      1. Everyone including + after the target key
-      2. Everyone before the target key
+    living = list(living_seats)
+    count = len(game.player_keys)
+    seat_next = list(range(count))
+    seat_prev = list(range(count))
+    if living:
+        for i, seat in enumerate(living):
+            seat_next[seat] = living[(i + 1) % len(living)]
+            seat_prev[seat] = living[i - 1]
+        living_set = set(living)
+        upcoming = living[0]
+        for seat in reversed(range(count)):
+            if seat in living_set:
+                upcoming = seat
+            else:
+                seat_next[seat] = upcoming
+        preceding = living[-1]
+        for seat in range(count):
+            if seat in living_set:
+                preceding = seat
+            else:
+                seat_prev[seat] = preceding
+    game.seat_next = seat_next
+    game.seat_prev = seat_prev
+    game.living_count = len(living)
+
+def eliminate_seat(game, seat):
+    """ Unlink a player who just lost their last die from the ring """
+    next_seat = game.seat_next[seat]
+    prev_seat = game.seat_prev[seat]
+    game.seat_next[prev_seat] = next_seat
+    game.seat_prev[next_seat] = prev_seat
+    game.living_count -= 1
+
+def next_living_seat(game, seat):
     """
-    count = len(all_keys)
-    i = all_keys.index(target_key)
-    slice1 = all_keys[i: count]
-    slice2 = all_keys[0:i]
-    output = slice1 + slice2
-    return output
+    The first living seat after {seat}.  One step for a living seat;
+    an eliminated seat may need a few, if its neighbours were also
+    knocked out since.
+    """
+    for _ in range(len(game.player_keys)):
+        seat = game.seat_next[seat]
+        if game.hand_size(game.player_keys[seat]):
+            return seat
+    raise GameRosterError("Unable to choose next player")
@@ -1,7 +1,13 @@
+import json
+
 import webapp2
+from google.appengine.api import oauth
+from google.appengine.ext import ndb
 
-import api
-import email_task
+import auth
+import rate_limit
+import wire
+from models import User, Game
 
 
 class SendReminderEmail(webapp2.RequestHandler):
@@ -10,9 +16,162 @@ class SendReminderEmail(webapp2.RequestHandler):
         Send a reminder email to each User with a "stale" game.
         Called once daily using a cron job.
         """
+        # Only needed once a day, so keep it out of instance startup
+        import email_task
         email_task.start()
 
 
+class ArchiveGames(webapp2.RequestHandler):
+    def get(self):
+        """
+        Move completed games into compressed cold storage.
+        Called once daily using a cron job.
+        """
+        import archive
+        archive.start()
+
+
+class RunMigration(webapp2.RequestHandler):
+    def post(self, name):
+        """ Start one of the background schema migrations listed in migrations.py """
+        import migrations
+        if name not in migrations.MIGRATIONS:
+            self.abort(404)
+        migrations.start(name)
+        self.response.write("Started migration {}".format(name))
+
+
+class StartExport(webapp2.RequestHandler):
+    def post(self):
+        """ Start a streaming export of all users and games (see export.py) """
+        import export
+        destination = self.request.get('destination')
+        if not destination:
+            self.abort(400, detail='A destination is required')
+        error = export.destination_error(destination)
+        if error:
+            self.abort(400, detail=error)
+        job = export.start(destination)
+        self.response.write("Started export job {}".format(job.key.id()))
+
+
+class ExportStatus(webapp2.RequestHandler):
+    def get(self, job_id):
+        """ Report an export job's progress """
+        self.write_status(self.get_job(job_id))
+
+    def post(self, job_id):
+        """ Restart an export job from its last checkpoint, then report its progress """
+        import export
+        job = self.get_job(job_id)
+        if not job.done:
+            job = export.resume(job.key.id()) or job
+        self.write_status(job)
+
+    def get_job(self, job_id):
+        from models import ExportJob
+        job = ExportJob.get_by_id(int(job_id))
+        if not job:
+            self.abort(404)
+        return job
+
+    def write_status(self, job):
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps({
+            'destination': job.destination,
+            'phase': job.phase,
+            'shards': job.shard_count,
+            'records': job.record_count,
+            'done': job.done,
+            'error': job.error,
+        }))
+
+
+class Warmup(webapp2.RequestHandler):
+    def get(self):
+        """ Preload modules before the instance receives user traffic """
+        import warmup
+        warmup.run()
+
+
+class FastJsonHandler(webapp2.RequestHandler):
+    """
+    Base class for the direct JSON versions of our hot read endpoints.
+    Response bodies are byte-for-byte identical to the Endpoints versions,
+    but are written straight from the models (see wire.py).
+    """
+    def current_user_model(self):
+        """ Mirrors the rate_limited('read') and login_required API decorators """
+        current_user = auth.id_token_user(self.request.headers.get('Authorization', ''))
+        if current_user is None:
+            try:
+                current_user = oauth.get_current_user(auth.EMAIL_SCOPE)
+                client_id = oauth.get_client_id(auth.EMAIL_SCOPE)
+            except oauth.Error:
+                self.abort(401, detail='Invalid token')
+            # Endpoints only accepts tokens issued to our own clients, so we must too
+            if client_id not in auth.ALLOWED_CLIENT_IDS:
+                self.abort(401, detail='Invalid token')
+        if not rate_limit.allow(current_user.email(), 'read'):
+            self.abort(403, detail='Rate limit exceeded, try again later')
+        return User.get_or_create(current_user.email())
+
+    def write_json(self, body):
+        self.response.content_type = 'application/json'
+        self.response.write(body)
+
+
+class FastGameList(FastJsonHandler):
+    def get(self):
+        """ Fast path for games.list """
+        user = self.current_user_model()
+        if self.request.get('my_pending_games_only').lower() == 'true':
+            game_keys = Game.get_pending(user, keys_only=True)
+        else:
+            game_keys = Game.get_all(keys_only=True)
+        self.write_json(wire.game_collection_json(game_keys))
+
+
+class FastGameLookup(FastJsonHandler):
+    def get(self, game_id):
+        """ Fast path for games.lookup """
+        self.current_user_model()
+        body = wire.game_json(ndb.Key(Game, int(game_id)))
+        if body is None:
+            import archive
+            game = archive.load_game(int(game_id))
+            if not game:
+                self.abort(404)
+            body = wire.encode_games([game])[0]
+        self.write_json(body)
+
+
+class FastHandLookup(FastJsonHandler):
+    def get(self, game_id):
+        """ Fast path for games.hand.get """
+        user = self.current_user_model()
+        game = Game.get_by_id(int(game_id))
+        if not game:
+            import archive
+            game = archive.load_game(int(game_id))
+        if not game:
+            self.abort(404)
+        if user.key not in game.player_keys:
+            self.abort(403, detail='Only an enrolled player can perform that action')
+        dice = game.get_hand(user.key)
+        if not dice:
+            self.abort(404, detail='No hand found for current user in that game')
+        self.write_json(wire.hand_json(dice))
+
+
 APP = webapp2.WSGIApplication([
+    ('/_ah/warmup', Warmup),
     ('/crons/send_reminder', SendReminderEmail),
+    ('/crons/archive_games', ArchiveGames),
+    (r'/admin/migrations/(\w+)', RunMigration),
+    ('/admin/exports', StartExport),
+    (r'/admin/exports/(\d+)', ExportStatus),
+    (r'/fast/v1/games', FastGameList),
+    (r'/fast/v1/games/(\d+)', FastGameLookup),
+    (r'/fast/v1/games/(\d+)/hand', FastHandLookup),
 ], debug=True)
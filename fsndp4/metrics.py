@@ -0,0 +1,57 @@
+"""
+Approximate operational counters, shared across instances.
+
+Increments are buffered in-process and added to memcache with a single
+offset_multi call at most every FLUSH_SECONDS, so counting something on
+the request path almost never costs an RPC.  Memcache may evict counters
+and a dying instance loses its unflushed counts, so treat these as
+monitoring numbers, not records.
+"""
+import logging
+import threading
+import time
+
+from google.appengine.api import memcache
+
+
+KEY_PREFIX = 'metrics:'
+FLUSH_SECONDS = 10
+
+# Counter names reported by snapshot(); modules register theirs at import time
+NAMES = set()
+
+_lock = threading.Lock()
+_pending = {}
+_last_flush = time.time()
+
+
+def register(*names):
+    NAMES.update(names)
+
+def incr(name, delta=1):
+    with _lock:
+        _pending[name] = _pending.get(name, 0) + delta
+        due = time.time() - _last_flush >= FLUSH_SECONDS
+    if due:
+        flush()
+
+def flush():
+    """ Push this instance's buffered counts to memcache """
+    global _last_flush
+    with _lock:
+        counts = dict(_pending)
+        _pending.clear()
+        _last_flush = time.time()
+    if not counts:
+        return
+    try:
+        memcache.offset_multi(counts, key_prefix=KEY_PREFIX, initial_value=0)
+    except Exception:
+        # Losing a few counts is better than failing the request that triggered the flush
+        logging.exception("Unable to flush metrics")
+
+def snapshot():
+    """ Current value of every registered counter, including this instance's unflushed counts """
+    flush()
+    values = memcache.get_multi(list(NAMES), key_prefix=KEY_PREFIX)
+    return dict((name, int(values.get(name, 0))) for name in NAMES)
@@ -0,0 +1,73 @@
+"""
+Background schema migrations.
+
+Each migration rewrites every entity of a kind in cursor-driven batches,
+chaining task queue jobs so no single request has to touch the whole
+dataset.  Rewriting an entity is enough to apply most schema changes,
+e.g. a property that has become unindexed drops its index rows on put.
+
+Batches are paged as keys only, and each entity is read, transformed
+and put back in its own transaction, so a write that lands while a batch
+is in flight (a move in a live game, say) is never overwritten by a
+stale copy.  tools/check_migrations.py checks this.
+
+Other modules should call start() with one of the names in MIGRATIONS.
+"""
+import logging
+
+from google.appengine.ext import ndb
+
+import cursor_jobs
+from models import Game
+
+
+BATCH_SIZE = 100
+
+
+def rewrite_game(game):
+    """ Re-put a game as-is, without making it look freshly updated """
+    game._preserve_updated = True
+    return game
+
+def repack_game_state(game):
+    """ Decoding the legacy pickled scores and dice makes the put write packed_state """
+    game._preserve_updated = True
+    game._unpack_state()
+    return game
+
+# Name: (model class, function applied to each entity before it's re-put)
+MIGRATIONS = {
+    # Game.log stopped being indexed
+    'unindex_game_log': (Game, rewrite_game),
+    # Game.scores and Game.dice moved from pickled dicts into Game.packed_state
+    'pack_game_state': (Game, repack_game_state),
+}
+
+
+def start(name):
+    if name not in MIGRATIONS:
+        raise ValueError("Unknown migration: {}".format(name))
+    logging.info("Starting migration {}".format(name))
+    cursor_jobs.start(__migration_step, (name, None, 0))
+
+def __migration_step(state):
+    name, cursor_str, migrated = state
+    model, transform = MIGRATIONS[name]
+    cursor = ndb.Cursor(urlsafe=cursor_str) if cursor_str else None
+    keys, cursor, more = model.query().fetch_page(BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    for key in keys:
+        if migrate_entity(key, transform):
+            migrated += 1
+    if not more:
+        logging.info("Migration {} complete, rewrote {} entities".format(name, migrated))
+        return None
+    return name, cursor.urlsafe(), migrated
+
+@ndb.transactional
+def migrate_entity(key, transform):
+    """ Rewrite one entity from a fresh read, returns False if it's gone """
+    entity = key.get()
+    if not entity:
+        return False
+    transform(entity).put()
+    return True
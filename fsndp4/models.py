@@ -1,9 +1,14 @@
 import datetime
+import json
 import logging
+import zlib
 
 from google.appengine.ext import ndb
 
+import cache_policy
 import game_logic
+import state_codec
+import wire
 
 
 class User(ndb.Model):
@@ -34,8 +39,9 @@ class User(ndb.Model):
 
     @staticmethod
     def delete_all():
-        keys = User.query().fetch(keys_only=True)
-        ndb.delete_multi(keys)
+        """ Starts a background job to delete every user, returns the DeleteJob """
+        import bulk_delete
+        return bulk_delete.start('users')
 
     @staticmethod
     def email_from_key(user_key):
@@ -67,6 +73,15 @@ class Bid(ndb.Model):
         return inst
 
 
+class Hand(ndb.Model):
+    """
+    One player's dice in a large-table game.  Stored as a child of the
+    Game with ID seat + 1, so a move only rewrites the hands it changes
+    instead of the whole table's dice.
+    """
+    faces = ndb.IntegerProperty(repeated=True, indexed=False)
+
+
 class Game(ndb.Model):
     """
     Encapsulates a game state, its participants, and all required scoring info.
@@ -76,49 +91,80 @@ class Game(ndb.Model):
     active_player_key = ndb.KeyProperty(kind=User, required=True)
     # Only populated when the game is over
     winner_key = ndb.KeyProperty(kind=User, default=None)
-    # Key: a participanting player's key
-    # Value: that player's current score
-    scores = ndb.PickleProperty(required=True)
-    # Key: same as above
-    # Value: a list of integers representing the dice remaining
-    #   in that player's hand (may be an empty list if
-    #   the player has been eliminated)
-    dice = ndb.PickleProperty(required=True)
+    # Scores and hands by seat, in the compact format from state_codec.
+    # Decoded into the scores and dice dicts (see below) on first access,
+    # and re-encoded on put, so requests that never look at them skip it.
+    packed_state = ndb.BlobProperty()
+    # Games written before packed_state pickled those dicts directly.
+    # Still read if packed_state is missing, and cleared once it's written.
+    legacy_scores = ndb.PickleProperty('scores')
+    legacy_dice = ndb.PickleProperty('dice')
+    # Large tables keep hands in Hand child entities, and their sizes here
+    # (indexed by seat, i.e. position in player_keys)
+    large_table = ndb.BooleanProperty(default=False, indexed=False)
+    hand_sizes = ndb.IntegerProperty(repeated=True, indexed=False)
+    # Turn order: a doubly linked ring over the seats of players who
+    # still have dice.  Maintained by game_logic.
+    seat_next = ndb.IntegerProperty(repeated=True, indexed=False)
+    seat_prev = ndb.IntegerProperty(repeated=True, indexed=False)
+    living_count = ndb.IntegerProperty(default=0, indexed=False)
     high_bidder_key = ndb.KeyProperty(
         kind=User, default=None, indexed=False)
     high_bid = ndb.StructuredProperty(
         Bid, default=None, indexed=False)
-    log = ndb.StringProperty(repeated=True)
+    # Never queried, so keep it out of the indexes: otherwise every line
+    # ever logged costs two index row writes on each put
+    log = ndb.StringProperty(repeated=True, indexed=False)
     active = ndb.BooleanProperty(required=True, default=True)
-    updated = ndb.DateTimeProperty(required=True, auto_now=True)
+    # Set on every put (see _pre_put_hook), like auto_now, but schema
+    # migrations can opt out so stale games still look stale
+    updated = ndb.DateTimeProperty(required=True)
 
     @staticmethod
-    def create(player_emails):
-        """ Players should be an array of email address strings """
-        game = Game()
+    def create(player_emails, large_table=None):
+        """
+        Players should be an array of email address strings.
+        Tables of game_logic.LARGE_TABLE_PLAYERS or more are created in
+        large-table mode, unless {large_table} says otherwise.
+        """
+        if len(player_emails) > game_logic.MAX_TABLE_PLAYERS:
+            raise ValueError("Tables hold at most {} players".format(game_logic.MAX_TABLE_PLAYERS))
         player_keys = [User.get_or_create(x).key for x in player_emails]
         player_keys.sort()
+        if large_table is None:
+            large_table = len(player_keys) >= game_logic.LARGE_TABLE_PLAYERS
+        if large_table:
+            # Hands are child entities, so we need the game's key before its first put
+            game_id, _ = Game.allocate_ids(1)
+            game = Game(id=game_id)
+            game.large_table = True
+        else:
+            game = Game()
         game.player_keys = player_keys
         game_logic.initialize(game)
         game.put()
         return game
 
     @staticmethod
-    def get_all():
-        return Game.query().fetch(limit=None)
+    def get_all(keys_only=False):
+        return Game.query().fetch(limit=None, keys_only=keys_only)
 
     @staticmethod
-    def get_pending(user_model):
+    def get_pending(user_model, keys_only=False):
         """ Get all games that are waiting for {user} to make a move """
         q = Game.query(
             Game.active == True, 
             Game.active_player_key == user_model.key)
-        return q.fetch(limit=None)            
+        return q.fetch(limit=None, keys_only=keys_only)
 
     @staticmethod
     def delete_all():
-        keys = Game.query().fetch(keys_only=True)
-        ndb.delete_multi(keys)
+        """
+        Starts a background job to delete every game, including hands,
+        summaries and archives.  Returns the DeleteJob.
+        """
+        import bulk_delete
+        return bulk_delete.start('games')
 
     # Typically, you should only timestamp the first log
     # entry in a player-server interaction
@@ -140,4 +186,246 @@ class Game(ndb.Model):
         self.high_bid = None
         self.high_bidder_key = None
 
+    def owned_keys(self):
+        """ The game's key, plus its Hands' keys if it's a large table """
+        keys = [self.key]
+        if self.large_table:
+            keys += [self.hand_key(x) for x in range(len(self.player_keys))]
+        return keys
+
+    def delete(self):
+        keys = self.owned_keys()
+        ndb.delete_multi(keys)
+        wire.invalidate_deleted(keys)
+
+    # Key: a participanting player's key
+    # Value: that player's current score
+    @property
+    def scores(self):
+        self._unpack_state()
+        return self._scores
+
+    @scores.setter
+    def scores(self, value):
+        self._unpack_state()
+        self._scores = value
+
+    # Key: same as above
+    # Value: a list of integers representing the dice remaining
+    #   in that player's hand (may be an empty list if
+    #   the player has been eliminated)
+    #   Always empty for large tables, see Hand.
+    @property
+    def dice(self):
+        self._unpack_state()
+        return self._dice
+
+    @dice.setter
+    def dice(self, value):
+        self._unpack_state()
+        self._dice = value
+
+    def _unpack_state(self):
+        if getattr(self, '_scores', None) is not None:
+            return
+        if self.packed_state:
+            scores, hands = state_codec.decode(self.packed_state)
+            self._scores = dict(zip(self.player_keys, scores))
+            self._dice = dict(zip(self.player_keys, hands)) if hands is not None else {}
+        else:
+            self._scores = self.legacy_scores or {}
+            self._dice = self.legacy_dice or {}
+
+    def _pack_state(self):
+        """ Re-encode scores and dice, if they were ever decoded """
+        if getattr(self, '_scores', None) is None:
+            return
+        hands = None
+        if not self.large_table:
+            hands = [self._dice.get(x) or [] for x in self.player_keys]
+        self.packed_state = state_codec.encode(
+            [self._scores.get(x, 0) for x in self.player_keys], hands)
+        self.legacy_scores = None
+        self.legacy_dice = None
+
+    # Per-player hand storage.  Small games keep every hand in the dice
+    # dict; large tables load and save individual Hand entities on demand.
+    def seat_of(self, player_key):
+        """ Position of {player_key} in player_keys """
+        index = getattr(self, '_seat_index', None)
+        if index is None or len(index) != len(self.player_keys):
+            index = dict((k, i) for i, k in enumerate(self.player_keys))
+            self._seat_index = index
+        return index[player_key]
+
+    def hand_key(self, seat):
+        return ndb.Key(Hand, seat + 1, parent=self.key)
+
+    def _loaded_hands(self):
+        """ Large tables only: seat -> faces for every Hand loaded so far """
+        if getattr(self, '_hands', None) is None:
+            self._hands = {}
+            self._dirty_seats = set()
+        return self._hands
+
+    def hand_size(self, player_key):
+        if self.large_table:
+            return self.hand_sizes[self.seat_of(player_key)]
+        return len(self.dice.get(player_key) or [])
+
+    def get_hand(self, player_key):
+        """ The dice in a player's hand (an empty list if they've been eliminated) """
+        if not self.large_table:
+            return self.dice.get(player_key) or []
+        seat = self.seat_of(player_key)
+        hands = self._loaded_hands()
+        if seat not in hands:
+            hand = self.hand_key(seat).get()
+            hands[seat] = hand.faces if hand else []
+        faces = hands[seat]
+        size = self.hand_sizes[seat]
+        # drop_die() removes dice from the front without rewriting the Hand
+        return faces[len(faces) - size:] if size else []
+
+    def prefetch_hands(self, player_keys):
+        """ Batch-load the Hands we're about to read (large tables only) """
+        self.prefetch_hands_async(player_keys).get_result()
+
+    @ndb.tasklet
+    def prefetch_hands_async(self, player_keys):
+        if not self.large_table:
+            return
+        hands = self._loaded_hands()
+        seats = [x for x in (self.seat_of(k) for k in player_keys) if x not in hands]
+        loaded = yield ndb.get_multi_async([self.hand_key(x) for x in seats])
+        for seat, hand in zip(seats, loaded):
+            hands[seat] = hand.faces if hand else []
+
+    def set_hand(self, player_key, faces):
+        if not self.large_table:
+            self.dice[player_key] = faces
+            return
+        if len(self.hand_sizes) != len(self.player_keys):
+            self.hand_sizes = [0] * len(self.player_keys)
+        seat = self.seat_of(player_key)
+        self._loaded_hands()[seat] = faces
+        self._dirty_seats.add(seat)
+        self.hand_sizes[seat] = len(faces)
+
+    def drop_die(self, player_key):
+        """ Removes the first die from a player's hand """
+        if not self.large_table:
+            del self.dice[player_key][0]
+            return
+        self.hand_sizes[self.seat_of(player_key)] -= 1
+
+    def put(self, **ctx_options):
+        """
+        Large tables write their changed Hands in the same transaction as
+        the game (they're its children, so it's a single entity group).
+        A failed put never leaves rerolled hands next to a stale turn.
+        """
+        if not (self.large_table and getattr(self, '_dirty_seats', None)):
+            return super(Game, self).put(**ctx_options)
+        hands = [Hand(key=self.hand_key(x), faces=self._hands[x]) for x in self._dirty_seats]
+        # The local stubs don't enforce the datastore's limit, so we do
+        if len(hands) + 1 > game_logic.MAX_COMMIT_ENTITIES:
+            raise ValueError("Can't commit {} hands with their game".format(len(hands)))
+        def write():
+            ndb.put_multi([self] + hands, **ctx_options)
+        if ndb.in_transaction():
+            write()
+        else:
+            ndb.transaction(write)
+        self._dirty_seats = set()
+        return self.key
+    _put = put
+
+    def _pre_put_hook(self):
+        if not getattr(self, '_preserve_updated', False):
+            self.updated = datetime.datetime.utcnow()
+        self._pack_state()
+
+    # Keep the pre-serialized JSON used by the wire fast path in sync,
+    # and let the cache policy know which games have finished.  Inside a
+    # transaction this waits for the commit: invalidating any sooner would
+    # let a reader cache the pre-commit game for GAME_CACHE_SECONDS.
+    def _post_put_hook(self, future):
+        ndb.get_context().call_on_commit(self._after_write)
+
+    def _after_write(self):
+        wire.invalidate(self.key.id())
+        cache_policy.note_game(self)
+
+    @classmethod
+    def _post_get_hook(cls, key, future):
+        if not future.get_exception():
+            cache_policy.note_game(future.get_result())
+
+
+class GameArchive(ndb.Model):
+    """
+    Cold storage for a batch of completed games.  The games are stored
+    as a zlib-compressed JSON list of records (see archive.py), and are
+    never modified once written.
+    """
+    data = ndb.BlobProperty(required=True)
+    game_count = ndb.IntegerProperty(required=True, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+    def records(self):
+        return json.loads(zlib.decompress(self.data))
+
+
+class GameSummary(ndb.Model):
+    """
+    The small stub left behind in place of an archived Game.  Shares its
+    ID with the original Game, and holds just enough to answer leaderboard
+    queries and to find the full game in its GameArchive.
+    """
+    player_keys = ndb.KeyProperty(kind=User, repeated=True)
+    winner_key = ndb.KeyProperty(kind=User, default=None)
+    archive_key = ndb.KeyProperty(kind=GameArchive, required=True, indexed=False)
+
+
+class ExportJob(ndb.Model):
+    """
+    Progress checkpoint for a streaming export (see export.py).  Updated
+    after every shard is written, so an interrupted job resumes from
+    the last complete shard.
+    """
+    destination = ndb.StringProperty(required=True, indexed=False)
+    # Kind currently being exported; None once the job is done
+    phase = ndb.StringProperty(indexed=False)
+    cursor = ndb.TextProperty()
+    shard_count = ndb.IntegerProperty(default=0, indexed=False)
+    record_count = ndb.IntegerProperty(default=0, indexed=False)
+    done = ndb.BooleanProperty(default=False, indexed=False)
+    # Why the job stopped for good, if it did; cleared on resume
+    error = ndb.TextProperty()
+    # Which chain of tasks may move the job on (see cursor_jobs.claim)
+    run_token = ndb.StringProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class DeleteJob(ndb.Model):
+    """
+    Progress checkpoint for a bulk delete (see bulk_delete.py).  Updated
+    after every page of keys is deleted.
+    """
+    # One of bulk_delete.TARGETS
+    target = ndb.StringProperty(required=True, indexed=False)
+    # Kind currently being deleted; None once the job is done
+    phase = ndb.StringProperty(indexed=False)
+    cursor = ndb.TextProperty()
+    deleted_count = ndb.IntegerProperty(default=0, indexed=False)
+    done = ndb.BooleanProperty(default=False, indexed=False)
+    # Which chain of tasks may move the job on (see cursor_jobs.claim)
+    run_token = ndb.StringProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
 
+# Memcache timeouts and hit rate counters for each kind (see cache_policy.py)
+cache_policy.apply()
@@ -0,0 +1,62 @@
+"""
+Per-user token bucket rate limiting for the API (see LiarsDiceApi.rate_limited).
+
+Every (user, endpoint class) pair has a bucket holding up to `capacity`
+tokens, refilled continuously at `rate` tokens per second; each request
+takes one token, and requests that find the bucket empty are rejected.
+
+Bucket state is a (tokens, timestamp) pair in memcache, updated with
+gets/cas.  If memcache is unavailable, or the bucket is too contended to
+update within CAS_RETRIES attempts, the request is let through: this is
+a guard against runaway clients, not worth failing real players over.
+"""
+import logging
+import time
+
+from google.appengine.api import memcache
+
+import metrics
+
+
+# Endpoint class: (bucket capacity, tokens refilled per second)
+LIMITS = {
+    'read': (30, 2.0),
+    'move': (10, 0.5),
+    'admin': (10, 0.2),
+}
+ENABLED = True
+KEY_PREFIX = 'rate:'
+CAS_RETRIES = 3
+
+REJECTED_METRIC = 'rate_limit.rejected.{}'
+metrics.register(*[REJECTED_METRIC.format(x) for x in LIMITS])
+
+
+def bucket_key(user_id, endpoint_class):
+    return "{}{}:{}".format(KEY_PREFIX, endpoint_class, user_id)
+
+def allow(user_id, endpoint_class):
+    """ Takes a token from the user's bucket; returns False if it was empty """
+    if not ENABLED:
+        return True
+    capacity, rate = LIMITS[endpoint_class]
+    key = bucket_key(user_id, endpoint_class)
+    # An idle bucket refills completely by the time it expires, so expiry loses nothing
+    expires = int(capacity / rate) + 1
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        now = time.time()
+        state = client.gets(key)
+        if state is None:
+            if client.add(key, (capacity - 1.0, now), time=expires):
+                return True
+            continue
+        tokens, last = state
+        tokens = min(float(capacity), tokens + (now - last) * rate)
+        if tokens < 1:
+            metrics.incr(REJECTED_METRIC.format(endpoint_class))
+            return False
+        if client.cas(key, (tokens - 1, now), time=expires):
+            return True
+    logging.warning("Rate limit bucket {} is contended or unavailable, allowing request".format(key))
+    return True
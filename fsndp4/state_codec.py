@@ -0,0 +1,93 @@
+"""
+Compact, versioned encoding for a game's per-seat scores and hands
+(see Game.packed_state).  Everything is indexed by seat, i.e. position
+in Game.player_keys, so no keys are stored at all.
+
+Version 1 layout:
+  byte     version (1)
+  byte     flags (FLAG_HANDS if hands are included; large tables keep
+           theirs in Hand entities, so they leave them out)
+  varint   seat count n
+  n varint scores
+  if FLAG_HANDS:
+    n varint  hand sizes
+    nibbles   every face, seat by seat, two per byte (high nibble first,
+              padded with a zero nibble)
+"""
+
+VERSION = 1
+FLAG_HANDS = 0x01
+
+
+def _write_varint(out, value):
+    if value < 0:
+        raise ValueError("Can't encode negative value {}".format(value))
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode(scores, hands=None):
+    """
+    {scores} is a list of ints by seat, {hands} a list of face lists by
+    seat (or None to leave hands out).  Returns a byte string.
+    """
+    out = bytearray([VERSION, FLAG_HANDS if hands is not None else 0])
+    _write_varint(out, len(scores))
+    for score in scores:
+        _write_varint(out, int(score))
+    if hands is not None:
+        if len(hands) != len(scores):
+            raise ValueError("Got {} hands for {} seats".format(len(hands), len(scores)))
+        faces = []
+        for hand in hands:
+            _write_varint(out, len(hand))
+            faces.extend(hand)
+        if len(faces) % 2:
+            faces.append(0)
+        for i in range(0, len(faces), 2):
+            high, low = int(faces[i]), int(faces[i + 1])
+            if not (0 < high < 16 and 0 <= low < 16):
+                raise ValueError("Can't encode die faces {}, {}".format(high, low))
+            out.append(high << 4 | low)
+    return bytes(out)
+
+def decode(data):
+    """ Returns (scores, hands) as encode() took them; hands is None if they were left out """
+    data = bytearray(data)
+    if not data or data[0] != VERSION:
+        raise ValueError("Unknown packed state version {}".format(data[0] if data else None))
+    flags = data[1]
+    count, pos = _read_varint(data, 2)
+    scores = []
+    for _ in range(count):
+        score, pos = _read_varint(data, pos)
+        scores.append(score)
+    if not flags & FLAG_HANDS:
+        return scores, None
+    sizes = []
+    for _ in range(count):
+        size, pos = _read_varint(data, pos)
+        sizes.append(size)
+    hands = []
+    face = pos * 2
+    for size in sizes:
+        hand = []
+        for nibble in range(face, face + size):
+            byte = data[nibble >> 1]
+            hand.append(byte & 0x0f if nibble & 1 else byte >> 4)
+        hands.append(hand)
+        face += size
+    return scores, hands
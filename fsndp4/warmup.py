@@ -0,0 +1,33 @@
+"""
+Instance warmup.  App Engine sends /_ah/warmup to each new instance
+before routing user traffic to it, so anything slow to load on first
+use should be loaded here instead of during a player's request.
+
+Only in-process state belongs here (imports, module-level setup).
+Warmups arrive in bursts as we scale up, so anything that reads the
+datastore or fills shared memcache would be repeated by every new
+instance at exactly the moment load is highest.
+"""
+import logging
+import time
+
+
+def load_api():
+    """ Importing the api module builds the Endpoints service and its message descriptors """
+    import api
+
+STEPS = [
+    load_api,
+]
+
+
+def run():
+    for step in STEPS:
+        start = time.time()
+        try:
+            step()
+        except Exception:
+            # A failed warmup step only costs us speed, never correctness
+            logging.exception("Warmup step {} failed".format(step.__name__))
+        logging.info("Warmup step {} took {:.1f}ms".format(
+            step.__name__, (time.time() - start) * 1000))
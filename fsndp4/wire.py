@@ -0,0 +1,157 @@
+"""
+Direct JSON serialization for our hot read endpoints.
+
+Produces the same wire JSON that Endpoints generates for games.lookup,
+games.list and games.hand.get, but straight from the models instead of
+building a protorpc message tree and encoding it field by field.
+
+Public game JSON is cached in memcache as a pre-serialized blob, and
+invalidated whenever the game is written (see Game._post_put_hook).
+Like ndb's own entity cache, a reader that misses first claims the slot
+with a LOADING placeholder, then reads the game, then swaps its blob in
+with compare-and-set.  A write that lands in between deletes the claim,
+so the swap fails and the pre-write blob is never cached.
+
+Matching the Endpoints encoder byte for byte means following its rules:
+  - 64-bit IntegerFields are encoded as strings
+  - fields that are unset or empty lists are omitted entirely
+  - keys come out in CPython 2 dict order, using json.dumps defaults.
+    A dict's order depends on its set of keys and, where their hashes
+    collide (score_messages and winner do), on the order they went in.
+    So every dict is filled in the same order the encoder fills its own:
+    the order the message class iterates its fields (FIELD_ORDER below)
+tools/check_wire_compat.py compares our output against the real encoder.
+"""
+import json
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+
+GAME_CACHE_PREFIX = 'wire:game:'
+GAME_CACHE_SECONDS = 60
+# Placeholder held by a reader while it loads a game (blobs are always strings)
+LOADING = 0
+# Message: its fields in all_fields() order, which is how the encoder fills its dict
+FIELD_ORDER = {
+    'GameMessage': ('high_bidder', 'active_player', 'winner', 'high_bid', 'game_id', 'score_messages'),
+    'ScoreMessage': ('score', 'user'),
+    'BidMessage': ('count', 'rank'),
+}
+
+
+def cache_key(game_id):
+    return GAME_CACHE_PREFIX + str(game_id)
+
+def invalidate(game_id):
+    memcache.delete(cache_key(game_id))
+
+def invalidate_deleted(keys):
+    """
+    Call after deleting {keys}: drops the cached JSON for every Game among
+    them in one memcache call (other kinds are ignored).  Deletes don't
+    use a per-key hook, since bulk deletes remove hundreds of games at once.
+    """
+    cache_keys = [cache_key(x.id()) for x in keys if x.kind() == 'Game']
+    if cache_keys:
+        memcache.delete_multi(cache_keys)
+
+
+def user_dict(email):
+    return {'email': email}
+
+def load_emails(user_keys):
+    """ Batch lookup of user emails, keyed by user key """
+    unique_keys = list(set(user_keys))
+    users = ndb.get_multi(unique_keys)
+    return dict((k, u.email) for k, u in zip(unique_keys, users))
+
+def ordered(message, fields):
+    """ {fields} as a dict filled in {message}'s FIELD_ORDER """
+    result = {}
+    for name in FIELD_ORDER[message]:
+        if name in fields:
+            result[name] = fields[name]
+    return result
+
+def game_dict(game, emails):
+    """ Mirrors api.game_to_message; {emails} must cover every user key in the game """
+    fields = {}
+    score_messages = []
+    for key in game.player_keys:
+        score_messages.append(ordered('ScoreMessage', {
+            'user': user_dict(emails[key]),
+            'score': str(int(game.scores[key])),
+        }))
+    if score_messages:
+        fields['score_messages'] = score_messages
+    fields['active_player'] = user_dict(emails[game.active_player_key])
+    if game.high_bidder_key:
+        fields['high_bidder'] = user_dict(emails[game.high_bidder_key])
+    hb = game.high_bid
+    if hb:
+        fields['high_bid'] = ordered('BidMessage', {'count': str(int(hb.count)), 'rank': str(int(hb.rank))})
+    if game.winner_key:
+        fields['winner'] = user_dict(emails[game.winner_key])
+    fields['game_id'] = {'value': str(int(game.key.id()))}
+    return ordered('GameMessage', fields)
+
+def referenced_user_keys(game):
+    keys = list(game.player_keys)
+    keys.append(game.active_player_key)
+    if game.high_bidder_key:
+        keys.append(game.high_bidder_key)
+    if game.winner_key:
+        keys.append(game.winner_key)
+    return keys
+
+
+def encode_games(games):
+    """ Serialize a list of Game models, returns a list of JSON strings """
+    user_keys = []
+    for game in games:
+        user_keys.extend(referenced_user_keys(game))
+    emails = load_emails(user_keys)
+    return [json.dumps(game_dict(x, emails)) for x in games]
+
+def game_blobs(game_keys):
+    """
+    Returns the public JSON for each game in {game_keys}, in order.
+    Cached blobs are used where possible; only the misses are loaded
+    from the datastore.  Games that no longer exist are skipped.
+    """
+    client = memcache.Client()
+    cache_keys = [cache_key(x.id()) for x in game_keys]
+    blobs = dict((k, v) for k, v in client.get_multi(cache_keys).items() if v != LOADING)
+    missing = [k for k, ck in zip(game_keys, cache_keys) if ck not in blobs]
+    if missing:
+        missing_cache_keys = [cache_key(x.id()) for x in missing]
+        # Claim the empty slots (add fails where there's already a claim), then
+        # take cas IDs for the claims *before* reading, so any write after this
+        # point invalidates them
+        client.add_multi(dict((x, LOADING) for x in missing_cache_keys),
+                         time=GAME_CACHE_SECONDS)
+        claims = client.get_multi(missing_cache_keys, for_cas=True)
+        games = [x for x in ndb.get_multi(missing) if x]
+        fresh = dict(zip([cache_key(x.key.id()) for x in games], encode_games(games)))
+        client.cas_multi(dict((k, v) for k, v in fresh.items() if claims.get(k) == LOADING),
+                         time=GAME_CACHE_SECONDS)
+        blobs.update(fresh)
+    return [blobs[x] for x in cache_keys if x in blobs]
+
+def game_json(game_key):
+    """ Public JSON for one game (games.lookup), or None if it doesn't exist """
+    blobs = game_blobs([game_key])
+    return blobs[0] if blobs else None
+
+def game_collection_json(game_keys):
+    """ games.list response body """
+    blobs = game_blobs(game_keys)
+    if not blobs:
+        return '{}'
+    # json.dumps joins list items and dict keys with the same separators
+    return '{"game_messages": [' + ', '.join(blobs) + ']}'
+
+def hand_json(hand):
+    """ games.hand.get response body; {hand} must be a non-empty list """
+    return json.dumps({'die_rolls': [str(int(x)) for x in hand]})
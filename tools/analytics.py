@@ -0,0 +1,285 @@
+"""
+Gameplay analytics over exported games (see fsndp4/export.py).
+
+Loading flattens every shard into a few NumPy columns (one row per game,
+per call and per round), in parallel across a process pool.  Parsing the
+JSON is the slow part, so each shard's columns are cached next to it as
+{shard}.npz the first time it's loaded, and later runs read the cache
+instead (--no-cache skips it).  All of the aggregates below are computed
+with vectorized array operations, not per-game Python loops:
+  - bluff call success rate by the height of the bid being called
+  - spot on call frequency and success rate
+  - round length (moves per round) and rounds per game
+  - win rate by seat position (order in the sorted player_keys), per table size
+  - runner up scores at game end, for tuning POINTS_TO_WIN
+  - distribution of bid counts, for tuning the starting hand size
+
+Requires NumPy (not needed by the app itself).  See analytics_bench.py
+for load and aggregate timings on a large synthetic export.
+
+Example:
+  python tools/analytics.py exports/5629499534213120
+"""
+from __future__ import print_function
+
+import argparse
+import functools
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from array import array
+
+import numpy as np
+
+
+CALL_BLUFF = 0
+CALL_SPOT_ON = 1
+
+# Column name: array typecode
+GAME_COLUMNS = {'players': 'i', 'winner_seat': 'i', 'runner_up_score': 'i', 'rounds': 'i', 'moves': 'i'}
+CALL_COLUMNS = {'kind': 'b', 'correct': 'b', 'bid_count': 'i', 'bid_rank': 'i', 'players': 'i'}
+ROUND_COLUMNS = {'moves': 'i', 'players': 'i'}
+BID_COLUMNS = {'count': 'i', 'rank': 'i'}
+TABLES = ('games', 'calls', 'rounds', 'bids')
+
+
+def cache_path(path):
+    return path + '.npz'
+
+
+def load_shard(path, use_cache=True):
+    """
+    Column arrays for one shard: (games, calls, rounds, bids).  Read from
+    the shard's cache if it's at least as new as the shard, otherwise
+    parsed and then cached for next time.
+    """
+    if not use_cache:
+        return parse_shard(path)
+    cached = cache_path(path)
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+        try:
+            return read_columns(cached)
+        except (IOError, ValueError, KeyError):
+            pass  # Truncated or from an older column layout, so rebuild it
+    tables = parse_shard(path)
+    try:
+        write_columns(cached, tables)
+    except (IOError, OSError):
+        pass  # e.g. a read-only export directory, which just means no cache
+    return tables
+
+
+def write_columns(path, tables):
+    arrays = {}
+    for name, columns in zip(TABLES, tables):
+        for column, values in columns.items():
+            arrays['{}.{}'.format(name, column)] = values
+    # Written aside and renamed, so a killed run can't leave half a cache
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(temp_path, path)
+
+
+def read_columns(path):
+    tables = dict((name, {}) for name in TABLES)
+    expected = (GAME_COLUMNS, CALL_COLUMNS, ROUND_COLUMNS, BID_COLUMNS)
+    data = np.load(path)
+    try:
+        for key in data.files:
+            name, column = key.split('.', 1)
+            tables[name][column] = data[key]
+    finally:
+        data.close()
+    for name, columns in zip(TABLES, expected):
+        if set(tables[name]) != set(columns):
+            raise KeyError("{} has stale {} columns".format(path, name))
+    return tuple(tables[name] for name in TABLES)
+
+
+def parse_shard(path):
+    """
+    Flatten one shard into column arrays.  This is the only per-game
+    Python loop, and it runs once per game, the first time a shard is loaded.
+    """
+    games = dict((k, array(t)) for k, t in GAME_COLUMNS.items())
+    calls = dict((k, array(t)) for k, t in CALL_COLUMNS.items())
+    rounds = dict((k, array(t)) for k, t in ROUND_COLUMNS.items())
+    bids = dict((k, array(t)) for k, t in BID_COLUMNS.items())
+
+    with gzip.open(path, 'rb') as f:
+        for line in f:
+            record = json.loads(line)
+            players = record['players']
+            n = len(players)
+            high_bid = None
+            call = None
+            round_moves = 0
+            total_moves = 0
+            round_count = 0
+            for event in record['events']:
+                kind = event['type']
+                if kind == 'bid':
+                    high_bid = (event['count'], event['rank'])
+                    bids['count'].append(event['count'])
+                    bids['rank'].append(event['rank'])
+                    round_moves += 1
+                elif kind == 'call':
+                    call = CALL_SPOT_ON if event['call'] == 'spot_on' else CALL_BLUFF
+                    round_moves += 1
+                elif kind in ('lose_die', 'lose_die_others') and call is not None and high_bid:
+                    correct = event.get('correct', True) if kind == 'lose_die' else True
+                    calls['kind'].append(call)
+                    calls['correct'].append(1 if correct else 0)
+                    calls['bid_count'].append(high_bid[0])
+                    calls['bid_rank'].append(high_bid[1])
+                    calls['players'].append(n)
+                    call = None
+                elif kind in ('round_won', 'game_won'):
+                    rounds['moves'].append(round_moves)
+                    rounds['players'].append(n)
+                    total_moves += round_moves
+                    round_moves = 0
+                    round_count += 1
+                elif kind in ('reroll', 'refill'):
+                    high_bid = None
+            winner = record.get('winner')
+            seat = players.index(winner) if winner in players else -1
+            games['players'].append(n)
+            games['winner_seat'].append(seat)
+            games['runner_up_score'].append(
+                max([x for i, x in enumerate(record['scores']) if i != seat] or [0]))
+            games['rounds'].append(round_count)
+            games['moves'].append(total_moves + round_moves)
+
+    def to_numpy(columns):
+        return dict((k, np.frombuffer(v, dtype=v.typecode).copy() if len(v) else np.zeros(0, v.typecode))
+                    for k, v in columns.items())
+    return to_numpy(games), to_numpy(calls), to_numpy(rounds), to_numpy(bids)
+
+
+def concat(parts):
+    if not parts:
+        return {}
+    return dict((k, np.concatenate([p[k] for p in parts])) for k in parts[0])
+
+
+def rate_by(groups, success, minlength=0):
+    """ Per-group (count, success rate); groups must be small non-negative ints """
+    totals = np.bincount(groups, minlength=minlength)
+    hits = np.bincount(groups, weights=success, minlength=minlength)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.where(totals > 0, hits / np.maximum(totals, 1), np.nan)
+    return totals, rates
+
+
+def report(games, calls, rounds, bids, max_seats=8):
+    lines = []
+    completed = games['winner_seat'] >= 0
+    lines.append("Games: {} ({} completed)".format(len(games['players']), int(completed.sum())))
+
+    # Bluff calls by the height of the bid being called
+    bluff = calls['kind'] == CALL_BLUFF
+    counts, rates = rate_by(calls['bid_count'][bluff], calls['correct'][bluff])
+    lines.append("")
+    lines.append("Bluff calls by bid count (call correct = bid was a bluff):")
+    for height in np.nonzero(counts)[0]:
+        lines.append("  count {:>2}: {:>10} calls, {:6.1%} correct".format(
+            height, counts[height], rates[height]))
+
+    spot_on = ~bluff
+    lines.append("")
+    lines.append("Spot on calls: {} of {} calls ({:.1%}), {:.1%} correct".format(
+        int(spot_on.sum()), len(bluff),
+        spot_on.mean() if len(bluff) else 0.0,
+        calls['correct'][spot_on].mean() if spot_on.any() else 0.0))
+
+    lines.append("")
+    if len(rounds['moves']):
+        lines.append("Round length: mean {:.1f} moves, median {:.0f}, p90 {:.0f}".format(
+            rounds['moves'].mean(), np.median(rounds['moves']),
+            np.percentile(rounds['moves'], 90)))
+        sizes = np.unique(rounds['players'])
+        mean_by_size = (np.bincount(rounds['players'], weights=rounds['moves'])[sizes] /
+                        np.bincount(rounds['players'])[sizes])
+        for size, mean in zip(sizes, mean_by_size):
+            lines.append("  {:>3} players: {:.1f} moves per round".format(size, mean))
+    if completed.any():
+        per_game = games['rounds'][completed]
+        lines.append("Rounds per completed game: mean {:.2f}, distribution {}".format(
+            per_game.mean(),
+            dict((int(k), int(v)) for k, v in enumerate(np.bincount(per_game)) if v)))
+        # How close the rest of the table got: lots of games ending with a
+        # runner up one point short suggests POINTS_TO_WIN is about right
+        runner_up = np.bincount(games['runner_up_score'][completed])
+        lines.append("Runner up score at game end: {}".format(
+            ", ".join("{}: {:.1%}".format(k, v / float(runner_up.sum())) for k, v in enumerate(runner_up) if v)))
+
+    # Win rate by seat, per table size: seat s at a table of n players
+    lines.append("")
+    lines.append("Win rate by seat (completed games):")
+    n = games['players'][completed]
+    seat = games['winner_seat'][completed]
+    small = n <= max_seats
+    wins = np.bincount(n[small] * max_seats + seat[small],
+                       minlength=(max_seats + 1) * max_seats).reshape(max_seats + 1, max_seats)
+    tables = np.bincount(n[small], minlength=max_seats + 1)
+    for size in np.nonzero(tables)[0]:
+        rates = wins[size, :size] / float(tables[size])
+        lines.append("  {} players ({} games): {}".format(
+            size, tables[size], " ".join("{:5.1%}".format(x) for x in rates)))
+
+    lines.append("")
+    if len(bids['count']):
+        # Bids clustered at low counts suggest hands are bigger than they need to be
+        hist = np.bincount(bids['count'])
+        lines.append("Bid counts: {}".format(
+            ", ".join("{}x: {:.1%}".format(k, v / float(hist.sum())) for k, v in enumerate(hist) if v)))
+    return "\n".join(lines)
+
+
+def load(paths, processes, use_cache=True):
+    """ Load and concatenate every shard, returns (games, calls, rounds, bids) """
+    pool = multiprocessing.Pool(processes)
+    try:
+        parts = pool.map(functools.partial(load_shard, use_cache=use_cache), paths)
+    finally:
+        pool.close()
+        pool.join()
+    return [concat([p[i] for p in parts]) for i in range(len(TABLES))]
+
+
+def find_shards(export_dir):
+    return sorted(glob.glob(os.path.join(export_dir, 'game-*.jsonl.gz')) +
+                  glob.glob(os.path.join(export_dir, 'gamearchive-*.jsonl.gz')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('export_dir', help="directory holding one export job's shards")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--max-seats', type=int, default=8,
+        help="largest table size broken out in the seat report")
+    parser.add_argument('--no-cache', action='store_true',
+        help="parse every shard, without reading or writing the .npz caches")
+    args = parser.parse_args()
+
+    paths = find_shards(args.export_dir)
+    if not paths:
+        parser.error("no game shards found in {}".format(args.export_dir))
+
+    start = time.time()
+    games, calls, rounds, bids = load(paths, args.processes, use_cache=not args.no_cache)
+    loaded = time.time()
+    print(report(games, calls, rounds, bids, max_seats=args.max_seats))
+    print("")
+    print("Loaded {} shards in {:.1f}s, aggregated in {:.2f}s".format(
+        len(paths), loaded - start, time.time() - loaded))
+
+
+if __name__ == '__main__':
+    main()
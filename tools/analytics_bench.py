@@ -0,0 +1,133 @@
+"""
+Timing run for analytics.py on a large synthetic export.
+
+Writes --games randomly played games as gzipped JSONL shards in the
+export's record format (not timed), then times three loads through
+analytics.load(): without the .npz caches, the first cached load (parse
+plus cache write) and a repeat load served from the caches, and finally
+the report's aggregates.  The games only follow the shape of the real
+event stream (bids, calls, lost dice, rounds, wins), not its rules, which
+is all the loader's cost depends on.
+
+Requires NumPy.  Shards go to a temporary directory unless --dir is given.
+
+Example:
+  python tools/analytics_bench.py --games 1000000
+"""
+from __future__ import print_function
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import analytics
+
+
+POINTS_TO_WIN = 2
+STARTING_DICE = 5
+# Same as export.py, so shard counts match a real export of this size
+SHARD_SIZE = 200
+
+
+def synthetic_game(rng, game_id):
+    """ One export record, played out with random moves """
+    players = ['player{}@example.com'.format(i) for i in rng.sample(range(1000), rng.randint(2, 6))]
+    scores = [0] * len(players)
+    events = [{'type': 'start'}]
+    seat = 0
+    while max(scores) < POINTS_TO_WIN:
+        dice = [STARTING_DICE] * len(players)
+        while sum(1 for x in dice if x) > 1:
+            count, rank = 0, 6
+            for _ in range(rng.randint(1, 6)):
+                count, rank = (count + 1, rng.randint(1, 6)) if rank == 6 else (count, rank + 1)
+                events.append({'type': 'bid', 'player': players[seat], 'count': count, 'rank': rank})
+                events.append({'type': 'turn', 'player': players[seat]})
+            call = 'bluff' if rng.random() < 0.8 else 'spot_on'
+            events.append({'type': 'call', 'player': players[seat], 'call': call})
+            events.append({'type': 'reveal', 'player': players[seat],
+                           'hand': [rng.randint(1, 6) for _ in range(dice[seat])]})
+            if call == 'spot_on' and rng.random() < 0.3:
+                events.append({'type': 'lose_die_others'})
+                dice = [x - 1 if x and i != seat else x for i, x in enumerate(dice)]
+            else:
+                loser = rng.choice([i for i, x in enumerate(dice) if x])
+                events.append({'type': 'lose_die', 'player': players[loser],
+                               'correct': rng.random() < 0.5})
+                dice[loser] -= 1
+            events.append({'type': 'reroll'})
+            seat = rng.choice([i for i, x in enumerate(dice) if x])
+        winner = [i for i, x in enumerate(dice) if x][0] if any(dice) else seat
+        scores[winner] += 1
+        events.append({'type': 'round_won', 'player': players[winner], 'score': scores[winner]})
+        if scores[winner] < POINTS_TO_WIN:
+            events.append({'type': 'refill'})
+    events.append({'type': 'game_won', 'player': players[winner]})
+    return {'id': game_id, 'players': players, 'scores': scores, 'winner': players[winner],
+            'active': False, 'events': events}
+
+
+def write_shard(args):
+    path, first_id, count, seed = args
+    rng = random.Random(seed)
+    with gzip.open(path, 'wb') as f:
+        for game_id in range(first_id, first_id + count):
+            f.write((json.dumps(synthetic_game(rng, game_id)) + '\n').encode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--dir', help="where to write the shards (kept afterwards)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    export_dir = args.dir or tempfile.mkdtemp(prefix='analytics_bench')
+    try:
+        if not os.path.isdir(export_dir):
+            os.makedirs(export_dir)
+        jobs = [(os.path.join(export_dir, 'game-{:05d}.jsonl.gz'.format(i)),
+                 first, min(SHARD_SIZE, args.games - first), args.seed * 1000003 + i)
+                for i, first in enumerate(range(0, args.games, SHARD_SIZE))]
+        pool = multiprocessing.Pool(args.processes)
+        try:
+            pool.map(write_shard, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        paths = analytics.find_shards(export_dir)
+        for path in paths:
+            if os.path.exists(analytics.cache_path(path)):
+                os.remove(analytics.cache_path(path))
+
+        print("{} games in {} shards, {} processes".format(args.games, len(paths), args.processes))
+        print("{:<28}{:>10}{:>16}".format("step", "seconds", "games/s"))
+        timings = [
+            ('load, no cache', lambda: analytics.load(paths, args.processes, use_cache=False)),
+            ('load, building cache', lambda: analytics.load(paths, args.processes)),
+            ('load, from cache', lambda: analytics.load(paths, args.processes)),
+        ]
+        for label, step in timings:
+            start = time.time()
+            tables = step()
+            elapsed = time.time() - start
+            print("{:<28}{:>10.2f}{:>16.0f}".format(label, elapsed, args.games / elapsed))
+        start = time.time()
+        analytics.report(*tables)
+        elapsed = time.time() - start
+        print("{:<28}{:>10.2f}{:>16.0f}".format('aggregate', elapsed, args.games / elapsed))
+    finally:
+        if not args.dir:
+            shutil.rmtree(export_dir)
+
+
+if __name__ == '__main__':
+    main()
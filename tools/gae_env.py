@@ -0,0 +1,68 @@
+"""
+Helpers for running our offline tools (load tests, benchmarks, reports)
+against the App Engine SDK instead of a deployed instance.
+
+Set the GAE_SDK environment variable to the SDK root, or make sure
+dev_appserver.py is on your PATH.
+"""
+import os
+import sys
+
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(TOOLS_DIR), 'fsndp4')
+
+
+def find_sdk():
+    """ Locate the App Engine SDK root directory """
+    sdk_path = os.environ.get('GAE_SDK')
+    if sdk_path:
+        return sdk_path
+    for path_dir in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = os.path.join(path_dir, 'dev_appserver.py')
+        if os.path.exists(candidate):
+            return os.path.dirname(os.path.realpath(candidate))
+    raise EnvironmentError(
+        "Unable to find the App Engine SDK; set GAE_SDK to its root directory")
+
+
+def setup_paths(sdk_path=None):
+    """
+    Make the SDK's bundled libraries (ndb, endpoints, protorpc, webapp2...)
+    and our app's modules importable.  Safe to call more than once.
+    """
+    if APP_DIR in sys.path:
+        return
+    sdk_path = sdk_path or find_sdk()
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    endpoints_lib = os.path.join(sdk_path, 'lib', 'endpoints-1.0')
+    if os.path.isdir(endpoints_lib):
+        sys.path.insert(0, endpoints_lib)
+    sys.path.insert(0, APP_DIR)
+
+
+def activate_testbed():
+    """
+    Stand up local service stubs (datastore, memcache, task queue...)
+    so the app can run in-process.  Caller is responsible for calling
+    deactivate() on the returned testbed when finished.
+    """
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    # Endpoints reads the minor version out of this when api.APP is built
+    tb.setup_env(current_version_id='testbed-version.1', overwrite=True)
+    # Queries should see their own writes immediately, like a warm single-region datastore
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=APP_DIR)
+    tb.init_app_identity_stub()
+    tb.init_user_stub()
+    tb.init_mail_stub()
+    tb.init_urlfetch_stub()
+    return tb
@@ -0,0 +1,68 @@
+"""
+Per-move cost at different table sizes.
+
+Plays games at each table size against local service stubs and reports
+the mean time and datastore entity writes per move type.  With the ring
+turn order and per-seat Hand storage, bids should cost the same at 499
+players (the most a table holds) as at 5; bluff and spot on calls still
+reroll every living hand, as the rules require.
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+import gae_env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='5,50,499', help="comma separated table sizes")
+    parser.add_argument('--moves', type=int, default=300, help="moves per table size")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    gae_env.setup_paths()
+    tb = gae_env.activate_testbed()
+    try:
+        from google.appengine.api import apiproxy_stub_map
+        import game_logic
+        from models import Game, Bid
+        from write_cost import choose_move
+
+        puts = [0]
+        def count_puts(service, call, request, response):
+            if call == 'Put':
+                puts[0] += request.entity_size()
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'large_table_bench', count_puts, 'datastore_v3')
+
+        rng = random.Random(args.seed)
+        print("{:>8}{:>8}  {:<30}{:>8}{:>12}{:>14}".format(
+            "players", "mode", "move", "count", "mean ms", "entity puts"))
+        for size in [int(x) for x in args.sizes.split(',')]:
+            emails = ['player{}@example.com'.format(i) for i in range(size)]
+            game = Game.create(emails)
+            totals = {}
+            for _ in range(args.moves):
+                if not game.active:
+                    game = Game.create(emails)
+                label, action, action_args = choose_move(game, game_logic, Bid, rng)
+                puts[0] = 0
+                start = time.time()
+                action(*action_args)
+                elapsed = time.time() - start
+                count, seconds, writes = totals.get(label, (0, 0.0, 0))
+                totals[label] = (count + 1, seconds + elapsed, writes + puts[0])
+            mode = 'large' if game.large_table else 'small'
+            for label in sorted(totals):
+                count, seconds, writes = totals[label]
+                print("{:>8}{:>8}  {:<30}{:>8}{:>12.2f}{:>14.1f}".format(
+                    size, mode, label, count, seconds / count * 1000, float(writes) / count))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""
+Multi-client load generator for the Liar's Dice API.
+
+Simulates a crowd of players, each of whom enrolls, polls games.list
+for pending games, checks their hand and submits a move, pausing for a
+randomized "think time" between requests.  Players are lightweight
+state machines scheduled onto a small pool of worker threads, so
+thousands of them can be simulated at once.
+
+Two modes are supported:
+  inprocess: runs api.APP in this process against local service stubs
+             (requires the App Engine SDK, see gae_env.py).  Requests
+             are dispatched one at a time, since the stubs aren't
+             thread-safe; this measures per-request server cost.
+  http:      drives a running server (dev_appserver or deployed) through
+             the public REST paths.  Requires an OAuth bearer token for
+             every simulated player, supplied as "email token" lines.
+
+Example:
+  python tools/load_test.py --players 2000 --table-size 4 --duration 120
+"""
+from __future__ import print_function
+
+import argparse
+import heapq
+import json
+import os
+import random
+import threading
+import time
+
+import gae_env
+
+
+SPI_PREFIX = '/_ah/spi/LiarsDiceApi.'
+API_PREFIX = '/_ah/api/liars_dice/v1/'
+
+# Maps our service method names to their public REST (http method, path) pairs
+REST_ROUTES = {
+    'enroll_user': ('POST', 'enroll_user'),
+    'create_game': ('POST', 'games'),
+    'list_games': ('GET', 'games'),
+    'lookup_game': ('GET', 'games/{game_id}'),
+    'check_hand': ('GET', 'games/{game_id}/hand'),
+    'get_legal_moves': ('GET', 'games/{game_id}/legal_moves'),
+    'place_bid': ('POST', 'games/{game_id}/bids'),
+    'make_bluff_call': ('POST', 'games/{game_id}/bluff_calls'),
+    'make_spot_on_call': ('POST', 'games/{game_id}/spot_on_calls'),
+}
+
+
+def decode_body(body):
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+class InProcessTransport(object):
+    """ Calls the WSGI app directly, impersonating players via the endpoints auth env vars """
+    def __init__(self, rate_limits=False):
+        gae_env.setup_paths()
+        self.testbed = gae_env.activate_testbed()
+        # Imported late, since these need the SDK paths and service stubs in place
+        from google.appengine.ext import ndb
+        import webob
+        import api
+        import rate_limit
+        rate_limit.ENABLED = rate_limits
+        self.ndb = ndb
+        self.webob = webob
+        self.app = api.APP
+        self.lock = threading.Lock()
+
+    def make_admin(self, email):
+        from models import User
+        user = User.get_or_create(email)
+        user.is_admin = True
+        user.put()
+
+    def call(self, email, method_name, params):
+        request = self.webob.Request.blank(SPI_PREFIX + method_name)
+        request.method = 'POST'
+        # Outside dev_appserver, endpoints only answers its own frontend
+        request.headers['X-AppEngine-Peer'] = 'apiserving'
+        request.content_type = 'application/json'
+        request.body = json.dumps(params)
+        with self.lock:
+            os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+            os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+            # Each call should start with a cold in-context cache, just like a real request
+            self.ndb.set_context(self.ndb.make_default_context())
+            response = request.get_response(self.app)
+        return response.status_int, decode_body(response.body)
+
+    def close(self):
+        self.testbed.deactivate()
+
+
+class HttpTransport(object):
+    """ Calls a running server through the public REST paths """
+    def __init__(self, base_url, tokens):
+        self.base_url = base_url.rstrip('/')
+        self.tokens = tokens
+
+    def make_admin(self, email):
+        # Admin flags can only be set through the datastore console
+        pass
+
+    def call(self, email, method_name, params):
+        import urllib
+        import urllib2
+
+        http_method, template = REST_ROUTES[method_name]
+        params = dict(params)
+        path = template
+        if '{game_id}' in template:
+            path = template.format(game_id=params.pop('game_id'))
+        url = self.base_url + API_PREFIX + path
+        data = None
+        if http_method == 'GET':
+            if params:
+                url += '?' + urllib.urlencode(params)
+        else:
+            data = json.dumps(params)
+
+        request = urllib2.Request(url, data)
+        request.get_method = lambda: http_method
+        request.add_header('Content-Type', 'application/json')
+        request.add_header('Authorization', 'Bearer {}'.format(self.tokens[email]))
+        try:
+            response = urllib2.urlopen(request)
+            return response.getcode(), decode_body(response.read())
+        except urllib2.HTTPError as e:
+            return e.code, decode_body(e.read())
+
+    def close(self):
+        pass
+
+
+class Stats(object):
+    """ Thread-safe collection of per-method latencies and status codes """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+
+    def record(self, method_name, latency, status):
+        with self.lock:
+            self.latencies.setdefault(method_name, []).append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status >= 400:
+                self.errors[method_name] = self.errors.get(method_name, 0) + 1
+
+    def report(self, elapsed):
+        with self.lock:
+            lines = []
+            header = "{:<20}{:>9}{:>9}{:>9}{:>10}{:>10}{:>10}{:>10}".format(
+                "method", "count", "errors", "err %", "p50 ms", "p95 ms", "p99 ms", "max ms")
+            lines.append(header)
+            total = 0
+            total_errors = 0
+            for method_name in sorted(self.latencies):
+                samples = sorted(self.latencies[method_name])
+                errors = self.errors.get(method_name, 0)
+                total += len(samples)
+                total_errors += errors
+                lines.append("{:<20}{:>9}{:>9}{:>9.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                    method_name, len(samples), errors,
+                    100.0 * errors / len(samples),
+                    percentile(samples, 50) * 1000,
+                    percentile(samples, 95) * 1000,
+                    percentile(samples, 99) * 1000,
+                    samples[-1] * 1000))
+            lines.append("")
+            lines.append("Requests: {}  Errors: {} ({:.1f}%)  Throughput: {:.1f} req/s".format(
+                total, total_errors,
+                100.0 * total_errors / total if total else 0.0,
+                total / elapsed if elapsed else 0.0))
+            lines.append("Status codes: {}".format(
+                ", ".join("{}={}".format(k, v) for k, v in sorted(self.statuses.items()))))
+            return "\n".join(lines)
+
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    i = int(round((pct / 100.0) * (len(sorted_samples) - 1)))
+    return sorted_samples[i]
+
+
+class Player(object):
+    """
+    One simulated client.  run() is a generator that yields
+    (method_name, params) requests and receives (status, body)
+    responses, so the scheduler can interleave thousands of them.
+    """
+    def __init__(self, email, rng, bluff_rate=0.25, spot_on_rate=0.05):
+        self.email = email
+        self.rng = rng
+        self.bluff_rate = bluff_rate
+        self.spot_on_rate = spot_on_rate
+        self.session = self.run()
+
+    def run(self):
+        yield ('enroll_user', {})
+        while True:
+            status, body = yield ('list_games', {'my_pending_games_only': True})
+            games = (body or {}).get('game_messages', [])
+            if not games:
+                continue
+            game = self.rng.choice(games)
+            game_id = int(game['game_id']['value'])
+            status, hand = yield ('check_hand', {'game_id': game_id})
+            if status >= 400:
+                continue
+            status, moves = yield ('get_legal_moves', {'game_id': game_id})
+            if status >= 400:
+                continue
+            yield self.choose_move(game_id, moves)
+
+    def choose_move(self, game_id, moves):
+        """ Pick from the server's games.legal_moves list, favoring small raises """
+        bids = moves.get('bids', [])
+        roll = self.rng.random()
+        if moves.get('can_call_spot_on') and roll < self.spot_on_rate:
+            return ('make_spot_on_call', {'game_id': game_id})
+        if moves.get('can_call_bluff') and (roll < self.spot_on_rate + self.bluff_rate or not bids):
+            return ('make_bluff_call', {'game_id': game_id})
+        bid = bids[min(int(self.rng.expovariate(0.5)), len(bids) - 1)]
+        return ('place_bid', {'game_id': game_id, 'count': int(bid['count']), 'rank': int(bid['rank'])})
+
+
+class LoadTest(object):
+    """
+    Schedules players onto worker threads.  Each player has at most one
+    request in flight; after it completes, the player goes back on the
+    heap with a randomized think time.
+    """
+    def __init__(self, transport, players, workers, think_time, duration, rng):
+        self.transport = transport
+        self.workers = workers
+        self.think_time = think_time
+        self.duration = duration
+        self.rng = rng
+        self.stats = Stats()
+        self.cond = threading.Condition()
+        self.heap = []
+        self.seq = 0
+        now = time.time()
+        for player in players:
+            request = next(player.session)
+            # Stagger the initial logins so we don't start with a thundering herd
+            self.schedule(now + rng.uniform(0, think_time), player, request)
+
+    def schedule(self, due, player, request):
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.heap, (due, self.seq, player, request))
+            self.cond.notify()
+
+    def next_due(self, deadline):
+        with self.cond:
+            while True:
+                now = time.time()
+                if now >= deadline:
+                    return None
+                if self.heap and self.heap[0][0] <= now:
+                    return heapq.heappop(self.heap)
+                wait = deadline - now
+                if self.heap:
+                    wait = min(wait, self.heap[0][0] - now)
+                self.cond.wait(wait)
+
+    def worker(self, deadline):
+        while True:
+            item = self.next_due(deadline)
+            if item is None:
+                return
+            _, _, player, (method_name, params) = item
+            start = time.time()
+            try:
+                status, body = self.transport.call(player.email, method_name, params)
+            except Exception:
+                status, body = 599, None
+            self.stats.record(method_name, time.time() - start, status)
+            request = player.session.send((status, body))
+            think = self.rng.expovariate(1.0 / self.think_time) if self.think_time else 0
+            self.schedule(time.time() + think, player, request)
+
+    def run(self):
+        start = time.time()
+        deadline = start + self.duration
+        threads = [threading.Thread(target=self.worker, args=(deadline,))
+                   for _ in range(self.workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        return time.time() - start
+
+
+def create_games(transport, admin_email, emails, table_size):
+    """ Seat every player at a table, returns the number of games created """
+    transport.make_admin(admin_email)
+    created = 0
+    for i in range(0, len(emails) - table_size + 1, table_size):
+        table = emails[i:i + table_size]
+        status, _ = transport.call(admin_email, 'create_game', {
+            'user_messages': [{'email': x} for x in table]})
+        if status >= 400:
+            raise RuntimeError("Unable to create game, status {}".format(status))
+        created += 1
+    return created
+
+
+def load_tokens(path):
+    tokens = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                email, token = line.split(None, 1)
+                tokens[email] = token
+    return tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('inprocess', 'http'), default='inprocess')
+    parser.add_argument('--url', help="server root for http mode, e.g. http://localhost:8080")
+    parser.add_argument('--tokens', help="file of 'email token' lines for http mode")
+    parser.add_argument('--admin-email', default='admin@loadtest.example.com')
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--table-size', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--think-time', type=float, default=1.0,
+        help="mean seconds a player waits between requests")
+    parser.add_argument('--duration', type=float, default=60.0, help="seconds to run")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--rate-limits', action='store_true',
+        help="enforce the per-user rate limits in inprocess mode (always on in http mode)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.mode == 'http':
+        if not (args.url and args.tokens):
+            parser.error("http mode requires --url and --tokens")
+        tokens = load_tokens(args.tokens)
+        emails = sorted(x for x in tokens if x != args.admin_email)[:args.players]
+        transport = HttpTransport(args.url, tokens)
+    else:
+        emails = ['player{:05d}@loadtest.example.com'.format(i) for i in range(args.players)]
+        transport = InProcessTransport(args.rate_limits)
+
+    try:
+        games = create_games(transport, args.admin_email, emails, args.table_size)
+        print("Created {} games for {} players".format(games, len(emails)))
+        players = [Player(x, random.Random(rng.random())) for x in emails]
+        test = LoadTest(transport, players, args.workers, args.think_time, args.duration, rng)
+        elapsed = test.run()
+        print(test.stats.report(elapsed))
+    finally:
+        transport.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Offline replay verifier for exported games.
+
+Reads the game shards written by an export job (see fsndp4/export.py),
+re-applies every game's logged moves using game_logic's rules and turn
+order, and flags games whose log breaks the rules, or whose stored dice
+counts, scores, active player or winner disagree with the replay.
+
+Hands are rerolled at random and only the high bidder's hand is ever
+logged, so we check hand sizes rather than faces.
+
+Shards are spread across a process pool, one shard per task.
+
+Example:
+  python tools/replay_verifier.py exports/5629499534213120 --output flagged.jsonl
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import time
+
+import gae_env
+
+
+game_logic = None
+
+def init_worker():
+    global game_logic
+    gae_env.setup_paths()
+    import game_logic as gl
+    game_logic = gl
+
+
+class ReplayState(object):
+    """ Just enough of a Game for game_logic's turn order helpers """
+    def __init__(self, players):
+        self.player_keys = players
+        self.seats = dict((p, i) for i, p in enumerate(players))
+        self.sizes = dict((p, game_logic.STARTING_HAND_SIZE) for p in players)
+        self.scores = dict((p, 0) for p in players)
+        self.seat_next = []
+        self.seat_prev = []
+        self.living_count = 0
+        game_logic.reset_turn_order(self)
+
+    def hand_size(self, player):
+        return self.sizes[player]
+
+    def seat_of(self, player):
+        return self.seats[player]
+
+    def refill(self):
+        for p in self.player_keys:
+            self.sizes[p] = game_logic.STARTING_HAND_SIZE
+        game_logic.reset_turn_order(self)
+
+    def remove_die(self, player):
+        if self.sizes[player] < 1:
+            return False
+        self.sizes[player] -= 1
+        if not self.sizes[player]:
+            game_logic.eliminate_seat(self, self.seat_of(player))
+        return True
+
+    def next_player(self, active):
+        if self.living_count < 1:
+            return None
+        return self.player_keys[game_logic.next_living_seat(self, self.seat_of(active))]
+
+
+def verify_game(record):
+    """ Replay one exported game, returns a list of problem descriptions """
+    problems = []
+    players = record['players']
+    state = None
+    active = None
+    winner = None
+    high_bid = None
+    high_bidder = None
+    call = None
+    expected = None
+
+    for i, event in enumerate(record['events']):
+        kind = event['type']
+        player = event.get('player')
+        where = "event {} ({})".format(i, kind)
+        if player is not None and player not in players:
+            problems.append("{}: unknown player {}".format(where, player))
+            break
+        if kind == 'start':
+            state = ReplayState(players)
+            active = players[0]
+            winner = high_bid = high_bidder = call = expected = None
+            continue
+        if state is None:
+            problems.append("{}: happened before the game started".format(where))
+            break
+        if winner is not None and kind != 'turn':
+            problems.append("{}: happened after the game ended".format(where))
+
+        if kind == 'bid':
+            if player != active:
+                problems.append("{}: {} bid out of turn".format(where, player))
+            index = game_logic.BID_INDEX.get((event['count'], event['rank']))
+            if index is None:
+                problems.append("{}: impossible bid {}x{}".format(where, event['count'], event['rank']))
+            elif high_bid and index <= game_logic.BID_INDEX[high_bid]:
+                problems.append("{}: bid {}x{} doesn't beat {}x{}".format(
+                    where, event['count'], event['rank'], high_bid[0], high_bid[1]))
+            high_bid = (event['count'], event['rank'])
+            high_bidder = player
+            expected = 'turn'
+        elif kind == 'call':
+            if player != active:
+                problems.append("{}: {} called out of turn".format(where, player))
+            if not high_bid:
+                problems.append("{}: called with no standing bid".format(where))
+            call = {'call': event['call'], 'caller': player, 'correct': None}
+        elif kind == 'reveal':
+            if not (call and high_bid):
+                problems.append("{}: hand revealed without a call".format(where))
+                continue
+            if player != high_bidder:
+                problems.append("{}: revealed {}'s hand, but {} was the high bidder".format(
+                    where, player, high_bidder))
+            hand = event['hand']
+            if len(hand) != state.sizes[player]:
+                problems.append("{}: {} showed {} dice, replay says {}".format(
+                    where, player, len(hand), state.sizes[player]))
+            count = len([x for x in hand if x == high_bid[1]])
+            if call['call'] == 'bluff':
+                call['correct'] = count < high_bid[0]
+            else:
+                call['correct'] = count == high_bid[0]
+        elif kind in ('lose_die', 'lose_die_others'):
+            if not call or call['correct'] is None:
+                problems.append("{}: dice lost without a call".format(where))
+                continue
+            if kind == 'lose_die':
+                if event['correct'] != call['correct']:
+                    problems.append("{}: call was judged {}, replay says {}".format(
+                        where, event['correct'], call['correct']))
+                if call['call'] == 'bluff' and call['correct']:
+                    loser = high_bidder
+                else:
+                    loser = call['caller']
+                if player != loser:
+                    problems.append("{}: {} lost a die, replay says {}".format(where, player, loser))
+                if not state.remove_die(player):
+                    problems.append("{}: {} had no dice to lose".format(where, player))
+            else:
+                if not (call['call'] == 'spot_on' and call['correct']):
+                    problems.append("{}: everyone else lost a die, but the call wasn't a correct spot on".format(where))
+                for p in game_logic.get_living_player_keys(state):
+                    if p != call['caller']:
+                        state.remove_die(p)
+            call = None
+            if state.living_count == 1:
+                expected = ('round_over', state.next_player(active))
+            else:
+                expected = 'reroll'
+        elif kind == 'reroll':
+            if expected != 'reroll':
+                problems.append("{}: unexpected reroll".format(where))
+            high_bid = high_bidder = None
+            expected = 'turn'
+        elif kind in ('round_won', 'game_won'):
+            if expected != ('round_over', player):
+                problems.append("{}: {} won the round, replay says {}".format(
+                    where, player, expected[1] if isinstance(expected, tuple) else None))
+            state.scores[player] += 1
+            if kind == 'round_won':
+                if event['score'] != state.scores[player]:
+                    problems.append("{}: logged score {}, replay says {}".format(
+                        where, event['score'], state.scores[player]))
+                if state.scores[player] >= game_logic.POINTS_TO_WIN:
+                    problems.append("{}: {} should have won the game".format(where, player))
+                expected = 'refill'
+            else:
+                if state.scores[player] < game_logic.POINTS_TO_WIN:
+                    problems.append("{}: {} won the game too early".format(where, player))
+                winner = player
+                expected = 'turn'
+        elif kind == 'refill':
+            if expected != 'refill':
+                problems.append("{}: unexpected refill".format(where))
+            state.refill()
+            high_bid = high_bidder = None
+            expected = 'turn'
+        elif kind == 'turn':
+            next_player = state.next_player(active)
+            if player != next_player:
+                problems.append("{}: turn passed to {}, replay says {}".format(where, player, next_player))
+            active = player
+            expected = None
+        else:
+            problems.append("{}: unrecognized log entry {!r}".format(where, event.get('text')))
+
+    if state is None:
+        problems.append("log never started the game")
+        return problems
+
+    # Compare the replay's final state with what was stored
+    replay_counts = [state.sizes[p] for p in players]
+    if record['dice_counts'] != replay_counts:
+        problems.append("stored dice counts {} disagree with replay {}".format(
+            record['dice_counts'], replay_counts))
+    replay_scores = [state.scores[p] for p in players]
+    if record['scores'] != replay_scores:
+        problems.append("stored scores {} disagree with replay {}".format(record['scores'], replay_scores))
+    if record['winner'] != winner:
+        problems.append("stored winner {} disagrees with replay {}".format(record['winner'], winner))
+    if record['active'] != (winner is None):
+        problems.append("stored active flag {} disagrees with replay".format(record['active']))
+    if 'active_player' in record and record['active_player'] != active:
+        problems.append("stored active player {} disagrees with replay {}".format(
+            record['active_player'], active))
+    return problems
+
+
+def verify_shard(path):
+    """ Returns (games checked, [(game id, problems)]) for one shard """
+    checked = 0
+    flagged = []
+    with gzip.open(path, 'rb') as f:
+        for line in f:
+            record = json.loads(line)
+            checked += 1
+            problems = verify_game(record)
+            if problems:
+                flagged.append((record['id'], problems))
+    return checked, flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('export_dir', help="directory holding one export job's shards")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--output', help="write flagged games here as JSON lines")
+    parser.add_argument('--show', type=int, default=20, help="flagged games to print")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.export_dir, 'game-*.jsonl.gz')) +
+                   glob.glob(os.path.join(args.export_dir, 'gamearchive-*.jsonl.gz')))
+    if not paths:
+        parser.error("no game shards found in {}".format(args.export_dir))
+
+    start = time.time()
+    pool = multiprocessing.Pool(args.processes, initializer=init_worker)
+    checked = 0
+    flagged = []
+    output = open(args.output, 'w') if args.output else None
+    try:
+        for shard_checked, shard_flagged in pool.imap_unordered(verify_shard, paths):
+            checked += shard_checked
+            flagged.extend(shard_flagged)
+            if output:
+                for game_id, problems in shard_flagged:
+                    output.write(json.dumps({'id': game_id, 'problems': problems}) + '\n')
+    finally:
+        pool.close()
+        pool.join()
+        if output:
+            output.close()
+
+    for game_id, problems in flagged[:args.show]:
+        print("Game {}:".format(game_id))
+        for problem in problems:
+            print("  " + problem)
+    print("Verified {} games from {} shards in {:.1f}s: {} flagged".format(
+        checked, len(paths), time.time() - start, len(flagged)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Cold start benchmark.
+
+Each measurement runs in a fresh interpreter, so nothing is cached in
+sys.modules.  For every WSGI entry point we report how long its module
+takes to import, how long until it has served its first request
+against local service stubs, and how many datastore calls that request
+made.  --games seeds that many active games first (not timed), since
+anything a first request reads scales with the datastore, not the code.
+Results are the median of --runs trials.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import gae_env
+
+
+# (label, module to import, request to send once it's loaded)
+ENTRY_POINTS = [
+    ('models', 'models', None),
+    ('main.APP', 'main', ('GET', '/_ah/warmup')),
+    ('api.APP', 'api', ('POST', '/_ah/spi/LiarsDiceApi.enroll_user')),
+]
+
+# Runs inside the child interpreter; prints one JSON line of timings
+CHILD_SCRIPT = """
+import json, os, sys, time
+sys.path.insert(0, {tools_dir!r})
+import gae_env
+gae_env.setup_paths()
+tb = gae_env.activate_testbed()
+os.environ['ENDPOINTS_AUTH_EMAIL'] = 'bench@example.com'
+os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+import webob
+from google.appengine.api import apiproxy_stub_map
+start = time.time()
+module = __import__({module!r})
+imported = time.time()
+first_request = None
+datastore_calls = None
+if {request!r}:
+    from models import Game
+    for i in range({games!r}):
+        Game.create(['seed{{}}a@example.com'.format(i), 'seed{{}}b@example.com'.format(i)])
+    # Seeding left everything cached, which a fresh deploy wouldn't have
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    memcache.flush_all()
+    ndb.get_context().clear_cache()
+    calls = []
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'bench', lambda service, *args: calls.append(service), 'datastore_v3')
+    request_start = time.time()
+    method, path = {request!r}
+    request = webob.Request.blank(path)
+    request.method = method
+    # Outside dev_appserver, endpoints only answers its own frontend
+    request.headers['X-AppEngine-Peer'] = 'apiserving'
+    if method == 'POST':
+        request.content_type = 'application/json'
+        request.body = '{{}}'
+    response = request.get_response(module.APP)
+    assert response.status_int == 200, response.status
+    first_request = imported - start + time.time() - request_start
+    datastore_calls = len(calls)
+print(json.dumps({{'import': imported - start, 'first_request': first_request,
+                  'datastore_calls': datastore_calls}}))
+"""
+
+
+def measure(module, request, games):
+    script = CHILD_SCRIPT.format(tools_dir=gae_env.TOOLS_DIR, module=module, request=request,
+                                 games=games)
+    output = subprocess.check_output([sys.executable, '-c', script], env=os.environ.copy())
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--games', type=int, default=0,
+        help="active games in the datastore before the first request")
+    args = parser.parse_args()
+
+    print("{:<12}{:>14}{:>22}{:>18}".format(
+        "entry point", "import ms", "first request ms", "datastore calls"))
+    for label, module, request in ENTRY_POINTS:
+        trials = [measure(module, request, args.games) for _ in range(args.runs)]
+        import_ms = median([x['import'] for x in trials]) * 1000
+        first = [x for x in trials if x['first_request'] is not None]
+        first_ms = "{:.1f}".format(median([x['first_request'] for x in first]) * 1000) if first else "-"
+        calls = str(median([x['datastore_calls'] for x in first])) if first else "-"
+        print("{:<12}{:>14.1f}{:>22}{:>18}".format(label, import_ms, first_ms, calls))
+
+if __name__ == '__main__':
+    main()
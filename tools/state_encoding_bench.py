@@ -0,0 +1,104 @@
+"""
+Size and decode time of Game.packed_state versus the legacy pickled
+scores and dice dicts, at several table sizes.
+
+For each size we build a mid-game position and report:
+  - bytes for the scores and dice blobs, and for the whole entity protobuf
+  - time to decode scores and dice (pickle.loads of both dicts versus
+    state_codec.decode plus rebuilding the key -> value dicts)
+  - time to load the entity from its protobuf and read the log only, as
+    games.logs.lookup does (packed state is never decoded there; ndb
+    defers unpickling legacy values until they're read, too, so this
+    mostly reflects the smaller entity)
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import pickle
+import random
+import timeit
+
+import gae_env
+
+
+def build_game(Game, User, ndb, size, rng):
+    """ A small-table game midway through a round, with a few points scored """
+    game = Game(id=rng.randint(1, 2 ** 52))
+    game.player_keys = sorted(ndb.Key(User, 'player{}@example.com'.format(i)) for i in range(size))
+    game.active_player_key = game.player_keys[0]
+    game.scores = dict((k, rng.randint(0, 1)) for k in game.player_keys)
+    game.dice = dict((k, [rng.randint(1, 6) for _ in range(rng.randint(0, 5))])
+                     for k in game.player_keys)
+    game.log = ["It is now {}'s turn".format(k.id()) for k in game.player_keys]
+    game.active = True
+    # Normally set by _pre_put_hook, which _to_pb() doesn't run
+    game.updated = datetime.datetime.utcnow()
+    return game
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='2,4,6,20,49', help="comma separated table sizes")
+    parser.add_argument('--repeat', type=int, default=2000, help="decodes timed per measurement")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    gae_env.setup_paths()
+    tb = gae_env.activate_testbed()
+    try:
+        from google.appengine.ext import ndb
+        import state_codec
+        from models import Game, User
+
+        rng = random.Random(args.seed)
+        print("{:>8}  {:<8}{:>12}{:>14}{:>16}{:>18}".format(
+            "players", "format", "blob bytes", "entity bytes", "decode us", "logs-only load us"))
+        for size in [int(x) for x in args.sizes.split(',')]:
+            game = build_game(Game, User, ndb, size, rng)
+            # A copy: _to_pb() wraps the values in the entity's own list in place
+            player_keys = list(game.player_keys)
+
+            # Legacy: exactly what ndb's PickleProperty stores
+            legacy_scores = pickle.dumps(game.scores, pickle.HIGHEST_PROTOCOL)
+            legacy_dice = pickle.dumps(game.dice, pickle.HIGHEST_PROTOCOL)
+            game.legacy_scores = game.scores
+            game.legacy_dice = game.dice
+            game.packed_state = None
+            legacy_pb = game._to_pb()
+
+            game.legacy_scores = None
+            game.legacy_dice = None
+            game._pack_state()
+            packed = game.packed_state
+            packed_pb = game._to_pb()
+
+            def decode_legacy():
+                pickle.loads(legacy_scores)
+                pickle.loads(legacy_dice)
+
+            def decode_packed():
+                scores, hands = state_codec.decode(packed)
+                dict(zip(player_keys, scores))
+                dict(zip(player_keys, hands))
+
+            def logs_only(pb):
+                return lambda: Game._from_pb(pb).log
+
+            rows = [
+                ('pickle', len(legacy_scores) + len(legacy_dice), legacy_pb,
+                 decode_legacy, logs_only(legacy_pb)),
+                ('packed', len(packed), packed_pb, decode_packed, logs_only(packed_pb)),
+            ]
+            for label, blob_bytes, pb, decode, load in rows:
+                decode_us = min(timeit.repeat(decode, number=args.repeat, repeat=3)) / args.repeat * 1e6
+                load_us = min(timeit.repeat(load, number=args.repeat, repeat=3)) / args.repeat * 1e6
+                print("{:>8}  {:<8}{:>12}{:>14}{:>16.1f}{:>18.1f}".format(
+                    size, label, blob_bytes, pb.ByteSize(), decode_us, load_us))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Datastore write-cost report.
+
+Plays randomized games against local service stubs and watches every
+datastore Put.  For each kind of move we report the average number of
+entity writes and index row writes it causes, where index rows are:
+  - one row per entity in the kind index
+  - an ascending and a descending row for every indexed property value
+  - one row per combination of values for each composite index in index.yaml
+Only rows that actually change between the old and new version of an
+entity count as writes (a removed row and an added row are both writes).
+
+Run with --legacy-schema to see the numbers for the old Game schema,
+where every log line was indexed.
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import os
+import random
+
+import gae_env
+
+
+class WriteCounter(object):
+    """ Datastore post-call hook that tallies writes under the current label """
+    def __init__(self, composites):
+        self.composites = composites
+        self.label = None
+        self.last_rows = {}
+        self.totals = {}
+
+    def index_rows(self, entity_pb):
+        kind = entity_pb.key().path().element_list()[-1].type()
+        rows = set([('__kind__',)])
+        values = {}
+        # property_list() only holds indexed properties; unindexed ones live in raw_property_list()
+        for prop in entity_pb.property_list():
+            value = prop.value().Encode()
+            values.setdefault(prop.name(), []).append(value)
+            rows.add(('asc', prop.name(), value))
+            rows.add(('desc', prop.name(), value))
+        for composite in self.composites.get(kind, []):
+            if all(x in values for x in composite):
+                for combo in itertools.product(*[values[x] for x in composite]):
+                    rows.add(('composite', composite, combo))
+        return rows
+
+    def hook(self, service, call, request, response):
+        if call != 'Put' or self.label is None:
+            return
+        entity_writes, index_writes = self.totals.get(self.label, (0, 0))
+        for entity_pb, key_pb in zip(request.entity_list(), response.key_list()):
+            key = key_pb.Encode()
+            rows = self.index_rows(entity_pb)
+            old_rows = self.last_rows.get(key, set())
+            self.last_rows[key] = rows
+            entity_writes += 1
+            index_writes += len(rows ^ old_rows)
+        self.totals[self.label] = (entity_writes, index_writes)
+
+
+def choose_move(game, game_logic, Bid, rng):
+    """ Returns (label, game_logic function, its args) for a random legal move """
+    bids, can_call = game_logic.legal_moves(game)
+    if can_call and (rng.random() < 0.4 or not bids):
+        if rng.random() < 0.2:
+            return 'games.spot_on_calls.create', game_logic.call_spot_on, (game,)
+        return 'games.bluff_calls.create', game_logic.call_bluff, (game,)
+    # Mostly small raises, like a real table
+    count, rank = bids[min(int(rng.expovariate(0.5)), len(bids) - 1)]
+    return 'games.bids.create', game_logic.place_bid, (game, Bid.create(count, rank))
+
+
+def load_composites():
+    import yaml
+    with open(os.path.join(gae_env.APP_DIR, 'index.yaml')) as f:
+        config = yaml.safe_load(f)
+    composites = {}
+    for index in config.get('indexes') or []:
+        names = tuple(x['name'] for x in index['properties'])
+        composites.setdefault(index['kind'], []).append(names)
+    return composites
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--players', type=int, default=4, help="players per game")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--legacy-schema', action='store_true',
+        help="index Game.log, as the original schema did")
+    args = parser.parse_args()
+
+    gae_env.setup_paths()
+    tb = gae_env.activate_testbed()
+    try:
+        from google.appengine.api import apiproxy_stub_map
+        import game_logic
+        from models import Game, Bid
+
+        if args.legacy_schema:
+            Game.log._indexed = True
+
+        counter = WriteCounter(load_composites())
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'write_cost', counter.hook, 'datastore_v3')
+
+        rng = random.Random(args.seed)
+        moves = {}
+        emails = ['player{}@example.com'.format(i) for i in range(args.players)]
+        for _ in range(args.games):
+            counter.label = 'games.create'
+            game = Game.create(emails)
+            moves['games.create'] = moves.get('games.create', 0) + 1
+            while game.active:
+                label, action, action_args = choose_move(game, game_logic, Bid, rng)
+                counter.label = label
+                action(*action_args)
+                moves[label] = moves.get(label, 0) + 1
+
+        print("Game schema: {}".format("legacy (indexed log)" if args.legacy_schema else "current"))
+        print("{:<30}{:>8}{:>16}{:>16}{:>12}".format(
+            "move", "count", "entity writes", "index writes", "total"))
+        for label in sorted(moves):
+            entity_writes, index_writes = counter.totals.get(label, (0, 0))
+            count = float(moves[label])
+            print("{:<30}{:>8}{:>16.1f}{:>16.1f}{:>12.1f}".format(
+                label, moves[label], entity_writes / count, index_writes / count,
+                (entity_writes + index_writes) / count))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()